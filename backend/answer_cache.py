@@ -0,0 +1,136 @@
+"""Semantic cache of tutor answers to recurring, context-free questions.
+
+Many students open a session with the same few questions ("what is a list",
+"explain recursion"). The tutor prompt only varies by IQ band, so an answer
+generated for one student in a band can be reused for another one asking the
+same question. Questions are embedded, and each band keeps its embeddings in one
+matrix, so a lookup is a single matrix-vector product followed by an argmax. A
+lookup hits when the nearest stored question is at least `threshold` similar.
+Entries expire after `ttl` seconds. When a band is full, its least recently used
+entry is replaced.
+"""
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "what", "whats", "how", "do", "does", "i", "me", "my", "can", "could",
+    "you", "please", "explain", "tell", "about", "in", "of", "to", "and", "python", "work", "works",
+}
+
+
+# Words that usually point back at earlier turns ("explain that again", "why does it fail?")
+BACK_REFERENCES = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|above|again|previous|earlier|before|same|"
+    r"continue|next|more|another|also|instead|yes|no|ok|okay)\b",
+    re.IGNORECASE,
+)
+
+
+def is_context_free(question, max_chars=200):
+    """Heuristic: a short question that doesn't refer back to the conversation."""
+    return len(question) <= max_chars and not BACK_REFERENCES.search(question)
+
+
+def iq_band(iq_score):
+    """The band the tutor prompt's initial style depends on."""
+    if iq_score is None:
+        return "default"
+    iq = int(float(iq_score))
+    if iq < 80:
+        return "low"
+    return "mid" if iq <= 105 else "high"
+
+
+def hashed_embedding(text, dim=512):
+    """Local bag-of-features embedding (words, word pairs and character trigrams hashed into
+    `dim` buckets). Cheap and needs no API call; good at near-identical phrasings."""
+    words = [w[:-1] if len(w) > 3 and w.endswith("s") else w
+             for w in re.findall(r"[a-z0-9_]+", text.lower().replace("'", ""))]
+    words = [w for w in words if w not in STOPWORDS] or words
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    features += [f"#{w[i:i + 3]}" for w in words for i in range(max(1, len(w) - 2))]
+    vector = np.zeros(dim, np.float32)
+    for feature in features:
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class _Band:
+    def __init__(self, capacity, dim):
+        self.vectors = np.zeros((capacity, dim), np.float32)
+        self.expires = np.zeros(capacity)  # 0 marks a free slot
+        self.last_used = np.zeros(capacity)
+        self.answers = [None] * capacity
+        self.questions = [None] * capacity
+
+
+class AnswerCache:
+    def __init__(self, embed=hashed_embedding, dim=512, threshold=0.9, max_entries_per_band=2048, ttl=86400):
+        self.embed = embed
+        self.dim = dim
+        self.threshold = threshold
+        self.max_entries_per_band = max_entries_per_band
+        self.ttl = ttl
+        self._bands = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _band(self, band):
+        if band not in self._bands:
+            self._bands[band] = _Band(self.max_entries_per_band, self.dim)
+        return self._bands[band]
+
+    def _nearest(self, entries, vector, now):
+        scores = entries.vectors @ vector
+        scores[entries.expires <= now] = -np.inf
+        best = int(np.argmax(scores))
+        return best, float(scores[best])
+
+    def get(self, band, question):
+        """Returns the cached answer for a similar question in this band, or None."""
+        vector = np.asarray(self.embed(question), np.float32)
+        now = time.time()
+        with self._lock:
+            entries = self._bands.get(band)
+            if entries is not None:
+                best, score = self._nearest(entries, vector, now)
+                if score >= self.threshold:
+                    entries.last_used[best] = now
+                    self.hits += 1
+                    return entries.answers[best]
+            self.misses += 1
+            return None
+
+    def put(self, band, question, answer):
+        vector = np.asarray(self.embed(question), np.float32)
+        now = time.time()
+        with self._lock:
+            entries = self._band(band)
+            best, score = self._nearest(entries, vector, now)
+            if score < self.threshold:
+                # Reuse a free or expired slot, else evict the least recently used entry
+                live = entries.expires > now
+                best = int(np.argmin(live)) if not live.all() else int(np.argmin(entries.last_used))
+            entries.vectors[best] = vector
+            entries.expires[best] = now + self.ttl
+            entries.last_used[best] = now
+            entries.answers[best] = answer
+            entries.questions[best] = question
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': sum(int((entries.expires > now).sum()) for entries in self._bands.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,151 @@
+"""Benchmark for the chat-history and session-list queries, with and without the indexes.
+
+Builds a throwaway SQLite database with the `chat` and `session` tables used by
+newback.py, fills it with synthetic rows and times the queries /chat, /history and
+/get-sessions run before and after creating the indexes the models declare: the
+full history, the conversation cache's sync window, the keyset pages of /history
+and the session list.
+
+    python bench_history_query.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+HISTORY_COLUMNS = (
+    "SELECT id, user_message, bot_response, images, timestamp FROM chat "
+    "WHERE user_id = ? AND session_name = ?"
+)
+# /history without paging parameters
+HISTORY_QUERY = HISTORY_COLUMNS + " ORDER BY timestamp, id"
+# Conversation cache sync (load_chat_turns_since): turns from the overlap window on
+SYNC_QUERY = (
+    "SELECT id, timestamp, user_message, bot_response FROM chat "
+    "WHERE user_id = ? AND session_name = ? AND timestamp >= ? ORDER BY timestamp, id"
+)
+# /history?limit=N (newest page) and ?before=<cursor> (older pages)
+LATEST_PAGE_QUERY = HISTORY_COLUMNS + " ORDER BY timestamp DESC, id DESC LIMIT 51"
+BEFORE_PAGE_QUERY = (
+    HISTORY_COLUMNS + " AND (timestamp < ? OR (timestamp = ? AND id < ?))"
+    " ORDER BY timestamp DESC, id DESC LIMIT 51"
+)
+# /history?after=<cursor>: catching up on newer turns
+AFTER_PAGE_QUERY = (
+    HISTORY_COLUMNS + " AND (timestamp > ? OR (timestamp = ? AND id > ?)) ORDER BY timestamp, id LIMIT 51"
+)
+SESSIONS_FULL_QUERY = "SELECT * FROM session WHERE user_id = ? ORDER BY timestamp DESC"
+SESSIONS_SHAPED_QUERY = "SELECT id, session_name, timestamp FROM session WHERE user_id = ? ORDER BY timestamp DESC"
+
+INDEXES = [
+    "CREATE INDEX ix_chat_user_session_time ON chat (user_id, session_name, timestamp)",
+    "CREATE UNIQUE INDEX uq_session_user_name ON session (user_id, session_name)",
+    "CREATE INDEX ix_session_user_time ON session (user_id, timestamp)",
+]
+
+
+def populate(conn, rows, users, sessions_per_user, portion_kb):
+    conn.execute(
+        "CREATE TABLE session (id INTEGER PRIMARY KEY, user_id VARCHAR(80) NOT NULL, "
+        "session_name VARCHAR(100) NOT NULL, study_mode VARCHAR(50), user_portion TEXT, ai_portion TEXT, "
+        "percentage_of_completion FLOAT, ingest_status VARCHAR(20), timestamp DATETIME)"
+    )
+    conn.execute(
+        "CREATE TABLE chat (id INTEGER PRIMARY KEY, user_id VARCHAR(80) NOT NULL, session_name VARCHAR(100), "
+        "user_message TEXT, bot_response TEXT NOT NULL, image_url VARCHAR(300), images TEXT, timestamp DATETIME)"
+    )
+    start = datetime(2025, 1, 1)
+    portion = "x" * (portion_kb * 1024)
+    conn.executemany(
+        "INSERT INTO session (user_id, session_name, user_portion, timestamp) VALUES (?, ?, ?, ?)",
+        ((f"user{u}", f"session{s}", portion, start + timedelta(minutes=u * sessions_per_user + s))
+         for u in range(users) for s in range(sessions_per_user))
+    )
+    message = "What is a list comprehension?"
+    response = "A list comprehension builds a list from an iterable. " * 8
+    conn.executemany(
+        "INSERT INTO chat (user_id, session_name, user_message, bot_response, timestamp) VALUES (?, ?, ?, ?, ?)",
+        ((f"user{random.randrange(users)}", f"session{random.randrange(sessions_per_user)}", message, response,
+          start + timedelta(seconds=i)) for i in range(rows))
+    )
+    conn.commit()
+
+
+def time_query(conn, sql, params_list):
+    timings = []
+    for params in params_list:
+        started = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), max(timings)
+
+
+def report(label, result):
+    print(f"  {label:<42} median {result[0]:9.3f} ms   max {result[1]:9.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000, help="chat rows to insert")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--sessions-per-user", type=int, default=5)
+    parser.add_argument("--portion-kb", type=int, default=64, help="size of each session's user_portion")
+    parser.add_argument("--samples", type=int, default=50, help="queries timed per case")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    conn = sqlite3.connect(path)
+    print(f"Populating {args.rows} chat rows and {args.users * args.sessions_per_user} sessions in {path} ...")
+    started = time.perf_counter()
+    populate(conn, args.rows, args.users, args.sessions_per_user, args.portion_kb)
+    print(f"  done in {time.perf_counter() - started:.1f} s")
+
+    history_params = [(f"user{random.randrange(args.users)}", f"session{random.randrange(args.sessions_per_user)}")
+                      for _ in range(args.samples)]
+    # Cursor positions spread over the whole history; the sync window is the last two minutes
+    start = datetime(2025, 1, 1)
+    pivots = [(start + timedelta(seconds=random.randrange(args.rows)), random.randrange(args.rows))
+              for _ in range(args.samples)]
+    sync_since = start + timedelta(seconds=args.rows - 120)
+    cases = [
+        ("history, whole session", HISTORY_QUERY, history_params),
+        ("conversation sync window", SYNC_QUERY, [params + (sync_since,) for params in history_params]),
+        ("history page, newest", LATEST_PAGE_QUERY, history_params),
+        ("history page, before cursor", BEFORE_PAGE_QUERY,
+         [params + (ts, ts, chat_id) for params, (ts, chat_id) in zip(history_params, pivots)]),
+        ("history page, after cursor", AFTER_PAGE_QUERY,
+         [params + (ts, ts, chat_id) for params, (ts, chat_id) in zip(history_params, pivots)]),
+    ]
+    session_params = [(f"user{random.randrange(args.users)}",) for _ in range(args.samples)]
+
+    print("Without indexes:")
+    for label, sql, params in cases:
+        report(label, time_query(conn, sql, params[:5]))
+    report("get-sessions, all columns", time_query(conn, SESSIONS_FULL_QUERY, session_params[:5]))
+
+    for statement in INDEXES:
+        conn.execute(statement)
+    conn.execute("ANALYZE")
+    conn.commit()
+
+    print("With indexes:")
+    for label, sql, params in cases:
+        report(label, time_query(conn, sql, params))
+    report("get-sessions, all columns", time_query(conn, SESSIONS_FULL_QUERY, session_params))
+    report("get-sessions, listed columns only", time_query(conn, SESSIONS_SHAPED_QUERY, session_params))
+    print("Query plans:")
+    for label, sql, params in cases:
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params[0]).fetchall()
+        print(f"  {label}: " + "; ".join(row[-1] for row in plan))
+
+    conn.close()
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Startup benchmark: import time and resident memory per backend subsystem.
+
+Each subsystem is imported in a fresh interpreter so shared dependencies don't hide
+each other's cost. Peak RSS is reported next to a bare interpreter's baseline.
+
+    python bench_startup.py
+    python bench_startup.py --with-app   # also time `import newback` (needs a .env)
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+SUBSYSTEMS = [
+    ("flask + sqlalchemy", "import flask, flask_sqlalchemy, sqlalchemy"),
+    ("google.generativeai", "import google.generativeai"),
+    ("httpx", "import httpx"),
+    ("cv2", "import cv2"),
+    ("mediapipe", "import mediapipe"),
+    ("deepface (tensorflow)", "from deepface import DeepFace"),
+    ("fitz (PyMuPDF)", "import fitz"),
+    ("speech_recognition", "import speech_recognition"),
+    ("pyttsx3 + init()", "import pyttsx3; pyttsx3.init()"),
+]
+
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+try:
+    exec(compile(sys.argv[1], "<subsystem>", "exec"))
+    error = None
+except Exception as e:
+    error = f"{type(e).__name__}: {e}"
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == "darwin":
+    rss //= 1024  # bytes on macOS, KiB elsewhere
+print(json.dumps({"seconds": time.perf_counter() - started, "rss_kb": rss, "error": error}))
+"""
+
+
+def measure(statement, env=None):
+    completed = subprocess.run(
+        [sys.executable, "-c", PROBE, statement],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    lines = completed.stdout.strip().splitlines()
+    if not lines:
+        stderr = completed.stderr.strip().splitlines()
+        return {"seconds": 0.0, "rss_kb": 0, "error": stderr[-1] if stderr else "interpreter crashed"}
+    return json.loads(lines[-1])
+
+
+def median_run(statement, runs, env=None):
+    results = sorted((measure(statement, env) for _ in range(runs)), key=lambda r: r["seconds"])
+    return results[len(results) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters per subsystem (median reported)")
+    parser.add_argument("--with-app", action="store_true", help="also time importing newback, lazily and preloaded")
+    args = parser.parse_args()
+
+    baseline = median_run("pass", args.runs)
+    print(f"Bare interpreter: {baseline['rss_kb'] / 1024:.1f} MB RSS")
+    print(f"  {'subsystem':<28} {'import':>10} {'RSS +':>10}")
+
+    cases = list(SUBSYSTEMS)
+    if args.with_app:
+        cases += [
+            ("newback (lazy)", "import newback"),
+            ("newback (PRELOAD_MODELS=1)", "import os; os.environ['PRELOAD_MODELS'] = '1'; import newback"),
+        ]
+    for label, statement in cases:
+        result = median_run(statement, args.runs)
+        if result["error"]:
+            print(f"  {label:<28} {'-':>10} {'-':>10}   not available ({result['error']})")
+            continue
+        extra_mb = (result["rss_kb"] - baseline["rss_kb"]) / 1024
+        print(f"  {label:<28} {result['seconds'] * 1000:8.0f} ms {extra_mb:7.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Shared, memoized concept extraction for image and video search.
+
+The same bot message usually reaches us twice: once from /chat (image enrichment)
+and again from /extract-concept when the student asks for a video. Results are
+cached on a hash of the normalised text, and concurrent requests for the same text
+wait on a single in-flight call (single-flight) instead of each calling Gemini.
+"""
+import asyncio
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    """Normalises a message the way the frontend displays it: bold markers removed,
+    whitespace collapsed, lower-cased."""
+    text = re.sub(r"\*\*(.*?)\*\*", r"\1", text or "")
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def text_key(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class ConceptExtractor:
+    """Wraps an async `extract(text) -> str` with an LRU result cache and single-flight dedupe.
+
+    All extraction runs on one event loop (`run(coro)` executes a coroutine there
+    from synchronous code), so in-flight calls can be shared as asyncio futures.
+    """
+
+    def __init__(self, extract, run, max_entries=2048):
+        self._extract = extract
+        self._run = run
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self._in_flight = {}  # key -> asyncio.Future, only touched on the event loop
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, key, count_miss=True):
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return self._results[key]
+            if count_miss:
+                self.misses += 1
+            return None
+
+    async def extract_async(self, text):
+        key = text_key(text)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            return await asyncio.shield(in_flight)
+
+        in_flight = self._in_flight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = (await self._extract(text)).strip()
+            with self._lock:
+                self._results[key] = result
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+            in_flight.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            in_flight.cancel()
+            raise
+        except Exception as e:
+            in_flight.set_exception(e)
+            in_flight.exception()  # mark retrieved so an unawaited failure isn't logged
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    def extract(self, text):
+        cached = self._cached(text_key(text), count_miss=False)
+        if cached is not None:
+            return cached
+        return self._run(self.extract_async(text))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._results),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
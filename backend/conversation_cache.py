@@ -0,0 +1,174 @@
+"""In-process cache of per-(user, session) conversation context for the /chat routes.
+
+Instead of reloading and replaying the whole session on every turn, each cached
+conversation keeps the turns it has already seen, so a request only pulls rows
+from around the newest timestamp it knows. Rows can become visible out of order
+(other processes commit their turns a little later), so every sync re-reads the
+last `sync_overlap` and skips the ids it has already seen. Once the estimated prompt size
+goes over the token budget, the oldest turns are folded into a compact summary
+until the turns replayed verbatim fit in `fold_to` of the budget. Folding well
+below the budget means the (blocking) summarisation call only happens again
+after that much new conversation, even when single replies are long.
+"""
+import logging
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+log = logging.getLogger(__name__)
+
+SUMMARY_PREFIX = "Summary of our conversation so far: "
+SUMMARY_ACK = "Thanks, I'll continue from there."
+
+
+def estimate_tokens(text):
+    """Rough token estimate (about 4 characters per token), good enough for budgeting."""
+    return len(text or "") // 4 + 1
+
+
+def turn_tokens(turn):
+    _, _, user_message, bot_response = turn
+    return estimate_tokens(user_message) + estimate_tokens(bot_response)
+
+
+class Conversation:
+    """Cached context of a single study session."""
+
+    def __init__(self):
+        self.summary = None
+        self.turns = []  # (timestamp, chat_id, user_message, bot_response), oldest first
+        self.tokens = 0
+        self.newest = None  # timestamp of the newest turn seen
+        self.seen = {}  # chat_id -> timestamp, for turns a sync may still return
+        self.folding = False  # a summary of old turns is being written
+        self.touched = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add_turn(self, chat_id, timestamp, user_message, bot_response):
+        if chat_id in self.seen:
+            return
+        self.seen[chat_id] = timestamp
+        turn = (timestamp, chat_id, user_message, bot_response)
+        bisect.insort(self.turns, turn)  # chat ids are unique, so messages are never compared
+        self.tokens += turn_tokens(turn)
+        if self.newest is None or timestamp > self.newest:
+            self.newest = timestamp
+
+    def remove_turns(self, turns):
+        chat_ids = {chat_id for _, chat_id, _, _ in turns}
+        self.turns = [turn for turn in self.turns if turn[1] not in chat_ids]
+        self.tokens = sum(turn_tokens(turn) for turn in self.turns)
+        if self.summary:
+            self.tokens += estimate_tokens(self.summary)
+
+    def forget_before(self, timestamp):
+        """Drops seen ids older than any sync will ask for again."""
+        self.seen = {chat_id: seen_at for chat_id, seen_at in self.seen.items() if seen_at >= timestamp}
+
+    def history(self):
+        """Returns the context in the `history` format expected by `start_chat`."""
+        history = []
+        if self.summary:
+            history.append({"role": "user", "parts": [SUMMARY_PREFIX + self.summary]})
+            history.append({"role": "model", "parts": [SUMMARY_ACK]})
+        for _, _, user_message, bot_response in self.turns:
+            history.append({"role": "user", "parts": [user_message]})
+            history.append({"role": "model", "parts": [bot_response]})
+        return history
+
+
+class ConversationCache:
+    """LRU + TTL cache of Conversation objects keyed on (user_id, session_name).
+
+    `summarizer(previous_summary, turns)` is called with the turns being folded out
+    of the window and must return the new summary text. It runs outside the
+    conversation's lock, so appends don't wait on it. If it fails the turns stay in
+    the window and the fold is tried again on the next request. Without a summarizer
+    the old turns are simply dropped, i.e. a plain rolling window.
+    """
+
+    def __init__(self, max_sessions=512, ttl=1800, token_budget=16000, fold_to=0.5, sync_overlap=120,
+                 summarizer=None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.token_budget = token_budget
+        self.fold_to = fold_to
+        self.sync_overlap = timedelta(seconds=sync_overlap)
+        self.summarizer = summarizer
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _conversation(self, key):
+        now = time.monotonic()
+        with self._lock:
+            conversation = self._conversations.get(key)
+            if conversation is not None and now - conversation.touched > self.ttl:
+                conversation = None
+            if conversation is None:
+                conversation = Conversation()
+                self._conversations[key] = conversation
+            conversation.touched = now
+            self._conversations.move_to_end(key)
+            while len(self._conversations) > self.max_sessions:
+                self._conversations.popitem(last=False)
+            return conversation
+
+    def history(self, key, load_since):
+        """Returns the prompt history for key, syncing only the turns it hasn't seen yet.
+
+        `load_since(since)` must return (chat_id, timestamp, user_message, bot_response)
+        tuples for rows with a timestamp at or after `since` (all rows when it is None).
+        """
+        conversation = self._conversation(key)
+        with conversation.lock:
+            since = conversation.newest - self.sync_overlap if conversation.newest is not None else None
+            for chat_id, timestamp, user_message, bot_response in load_since(since):
+                conversation.add_turn(chat_id, timestamp, user_message, bot_response)
+            if conversation.newest is not None:
+                conversation.forget_before(conversation.newest - self.sync_overlap)
+            folded = self._turns_to_fold(conversation)
+            if folded and self.summarizer is None:
+                conversation.remove_turns(folded)
+                folded = None
+            if not folded or conversation.folding:
+                return conversation.history()
+            conversation.folding = True
+            previous_summary = conversation.summary
+
+        try:
+            summary = self.summarizer(previous_summary, [(u, b) for _, _, u, b in folded])
+        except Exception as e:
+            log.error("Error summarising conversation, keeping its turns for now: %s", e)
+            summary = None
+        with conversation.lock:
+            conversation.folding = False
+            if summary is not None:
+                conversation.summary = summary
+                conversation.remove_turns(folded)
+            return conversation.history()
+
+    def append(self, key, chat_id, timestamp, user_message, bot_response):
+        """Records a turn that has just been saved so the next request doesn't reload it."""
+        conversation = self._conversation(key)
+        with conversation.lock:
+            conversation.add_turn(chat_id, timestamp, user_message, bot_response)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._conversations.pop(key, None)
+
+    def _turns_to_fold(self, conversation):
+        """The oldest turns to fold once over budget: all but the newest ones that fit under
+        the low watermark (and always the latest one)."""
+        if conversation.tokens <= self.token_budget or len(conversation.turns) <= 1:
+            return []
+        target = self.token_budget * self.fold_to
+        kept, kept_tokens = 1, turn_tokens(conversation.turns[-1])
+        for turn in reversed(conversation.turns[:-1]):
+            if kept_tokens + turn_tokens(turn) > target:
+                break
+            kept += 1
+            kept_tokens += turn_tokens(turn)
+        return conversation.turns[:-kept]
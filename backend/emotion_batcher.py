@@ -0,0 +1,80 @@
+"""Micro-batching scheduler for /emotion inference.
+
+Frames posted by many webcam clients at about the same time are collected for a
+short window (or until the batch is full) and classified in one forward pass,
+then each waiting request gets its own result back.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from per_process import PerProcess
+
+
+class MicroBatcher:
+    """Runs `process_batch(items) -> results` on batches gathered from concurrent `submit` calls.
+
+    A batch is closed `max_wait_ms` after its first item arrived or once it holds
+    `max_batch` items, whichever comes first, so no request waits on the window
+    for longer than `max_wait_ms`. Items whose caller has already given up are
+    dropped before processing. The worker thread is started on first use in each
+    process.
+    """
+
+    def __init__(self, process_batch, max_batch=16, max_wait_ms=20, name="batcher"):
+        self.process_batch = process_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self._queue = queue.Queue()
+        self._worker = PerProcess(self._start_worker)
+
+    def _start_worker(self):
+        self._queue = queue.Queue()
+        worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+        worker.start()
+        return worker
+
+    def submit(self, item, timeout=None):
+        """Queues an item and blocks until its result is ready (raises concurrent.futures.TimeoutError after timeout)."""
+        self._worker.get()
+        future = Future()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        self._queue.put((item, future, deadline))
+        try:
+            return future.result(timeout=timeout)
+        finally:
+            future.cancel()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        closes_at = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = closes_at - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            now = time.monotonic()
+            live = [
+                (item, future) for item, future, deadline in batch
+                if (deadline is None or deadline > now) and future.set_running_or_notify_cancel()
+            ]
+            if not live:
+                continue
+            try:
+                results = self.process_batch([item for item, _ in live])
+            except Exception as e:
+                for _, future in live:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(live, results):
+                future.set_result(result)
@@ -1,50 +1,142 @@
 import cv2
 import mediapipe as mp
 from deepface import DeepFace
+import logging
+import queue
 import threading
 import time
 
-running = False  # Global flag
+log = logging.getLogger(__name__)
 
-def start_emotion_detection(callback):
-    global running
-    running = True
 
-    cap = cv2.VideoCapture(0)
-    mp_face = mp.solutions.face_mesh.FaceMesh(static_image_mode=False)
+class EmotionDetectorService:
+    """Webcam emotion detector running capture and inference on separate threads.
+
+    The capture thread keeps only the newest frame (a size-1 queue that drops the
+    oldest frame), so inference never falls behind the camera. The inference thread
+    analyses at most `target_fps` frames per second, which is the knob for CPU use.
+    Subscribers are called with an emotion once it has been stable for
+    `stable_seconds`, then not again for `cooldown_seconds`.
+    """
+
+    def __init__(self, camera_index=0, target_fps=2.0, stable_seconds=3, cooldown_seconds=10):
+        self.camera_index = camera_index
+        self.target_fps = target_fps
+        self.stable_seconds = stable_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self._frames = queue.Queue(maxsize=1)
+        self._stop = threading.Event()
+        self._threads = []
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def subscribe(self, callback):
+        """Registers callback(emotion); returns a function that unsubscribes it."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+        return unsubscribe
+
+    def start(self):
+        if self.running and not self._stop.is_set():
+            return
+        self.join()  # let a previous run finish releasing the camera before restarting
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._capture_loop, name="emotion-capture", daemon=True),
+            threading.Thread(target=self._inference_loop, name="emotion-inference", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
 
-    last_emotion = None
-    stable_time = time.time()
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
 
-    while running:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    def _capture_loop(self):
+        cap = cv2.VideoCapture(self.camera_index)
+        try:
+            while not self._stop.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                # Drop the stale frame, if any, so the worker always gets the latest one
+                try:
+                    self._frames.get_nowait()
+                except queue.Empty:
+                    pass
+                self._frames.put_nowait(frame)
+        finally:
+            cap.release()
+            self._stop.set()
 
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = mp_face.process(rgb)
+    def _inference_loop(self):
+        mp_face = mp.solutions.face_mesh.FaceMesh(static_image_mode=False)
+        interval = 1.0 / self.target_fps if self.target_fps else 0
+        last_emotion = None
+        stable_time = time.time()
 
-        if results.multi_face_landmarks:
+        while not self._stop.is_set():
+            started = time.monotonic()
             try:
-                analysis = DeepFace.analyze(frame, actions=['emotion'], enforce_detection=False)
-                emotion = analysis[0]['dominant_emotion']
+                frame = self._frames.get(timeout=0.5)
+            except queue.Empty:
+                continue
 
-                # Stability check
-                if emotion != last_emotion:
-                    last_emotion = emotion
-                    stable_time = time.time()
-                elif time.time() - stable_time > 3:
-                    callback(emotion)
-                    stable_time = time.time() + 10  # Wait before checking again
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            results = mp_face.process(rgb)
 
+            if results.multi_face_landmarks:
+                try:
+                    analysis = DeepFace.analyze(frame, actions=['emotion'], enforce_detection=False)
+                    emotion = analysis[0]['dominant_emotion']
+
+                    # Stability check
+                    if emotion != last_emotion:
+                        last_emotion = emotion
+                        stable_time = time.time()
+                    elif time.time() - stable_time > self.stable_seconds:
+                        self._publish(emotion)
+                        stable_time = time.time() + self.cooldown_seconds  # Wait before checking again
+
+                except Exception as e:
+                    log.error("Emotion detection error: %s", e)
+
+            self._stop.wait(max(0.0, interval - (time.monotonic() - started)))
+
+        mp_face.close()
+
+    def _publish(self, emotion):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(emotion)
             except Exception as e:
-                print("Emotion detection error:", str(e))
+                log.error("Emotion callback error: %s", e)
 
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
 
-    cap.release()
+_service = None
+
+def start_emotion_detection(callback):
+    """Runs the detector and calls callback with stable emotions until stop_emotion_detection()."""
+    global _service
+    _service = EmotionDetectorService()
+    _service.subscribe(callback)
+    _service.start()
+    _service.join()
 
 def stop_emotion_detection():
-    global running
-    running = False
+    if _service is not None:
+        _service.stop()
@@ -0,0 +1,171 @@
+"""Preloaded DeepFace emotion model used by the /emotion route.
+
+The model is built and warmed up once (normally in a background thread at startup),
+and frames are decoded straight from the uploaded bytes, so a request only pays
+for inference: no temp files and no first-request model build. Faces from several
+frames can be classified in one forward pass with `analyze_batch`.
+
+Like `emotion_detector`, a fast MediaPipe face detector runs first: frames without
+a face never reach the emotion network, and only a small crop of the face is
+classified instead of the full frame.
+
+    python emotion_model.py   # checks that the model loads and classifies a frame
+"""
+import logging
+import threading
+import time
+
+import cv2
+import mediapipe as mp
+import numpy as np
+from deepface import DeepFace
+
+log = logging.getLogger(__name__)
+
+
+EMOTION_LABELS = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+EMOTION_INPUT_SIZE = (224, 224)  # what DeepFace.analyze hands the emotion client
+FACE_CROP_SIZE = (96, 96)
+
+
+def decode_image(data):
+    """Decodes encoded image bytes (JPEG/PNG) into a BGR array, or None if they aren't an image."""
+    if not data:
+        return None
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+class FaceDetector:
+    """MediaPipe face detector run on a downscaled copy of the frame. Not thread-safe."""
+
+    def __init__(self, min_confidence=0.5, detect_size=320, margin=0.15):
+        self.detect_size = detect_size
+        self.margin = margin
+        self._detector = mp.solutions.face_detection.FaceDetection(
+            model_selection=0, min_detection_confidence=min_confidence
+        )
+
+    def detect(self, frame):
+        """Returns the (x, y, w, h) box of the most confident face in frame coordinates, or None."""
+        height, width = frame.shape[:2]
+        scale = min(1.0, self.detect_size / max(height, width))
+        small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else frame
+        results = self._detector.process(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        if not results.detections:
+            return None
+        box = max(results.detections, key=lambda d: d.score[0]).location_data.relative_bounding_box
+        # Pad the box a little; MediaPipe boxes are tight around the eyes and mouth
+        x0 = max(0, int((box.xmin - self.margin * box.width) * width))
+        y0 = max(0, int((box.ymin - self.margin * box.height) * height))
+        x1 = min(width, int((box.xmin + (1 + self.margin) * box.width) * width))
+        y1 = min(height, int((box.ymin + (1 + self.margin) * box.height) * height))
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return x0, y0, x1 - x0, y1 - y0
+
+
+class EmotionModel:
+    """Owns the warm emotion model and reports whether it is ready to serve."""
+
+    def __init__(self):
+        self.status = "loading"
+        self.error = None
+        self.load_seconds = None
+        self._loaded = threading.Event()
+        self._classifier = None
+        self._detector = None
+        self._loading = False
+
+    def build(self):
+        """Loads the emotion network's weights. Not fork-safe: call it in the process that
+        will run inference (gunicorn workers do so from init_worker)."""
+        if self._classifier is None:
+            self._classifier = DeepFace.build_model(task="facial_attribute", model_name="Emotion")
+
+    def load(self):
+        """Builds the model and runs one warm-up inference so the first request isn't slow."""
+        started = time.perf_counter()
+        try:
+            self.build()
+            self._detector = FaceDetector()
+            blank = np.zeros((224, 224, 3), np.uint8)
+            self._detector.detect(blank)
+            scores = self.classify_faces([blank])
+            if len(scores) != 1 or set(scores[0]) != set(EMOTION_LABELS):
+                raise RuntimeError(f"Unexpected emotion model output: {scores}")
+            self.status = "ready"
+        except Exception as e:
+            log.error("Error loading emotion model: %s", e)
+            self.status = "failed"
+            self.error = str(e)
+        finally:
+            self.load_seconds = time.perf_counter() - started
+            self._loaded.set()
+
+    def start_loading(self):
+        if self._loading:
+            return
+        self._loading = True
+        threading.Thread(target=self.load, name="emotion-model-warmup", daemon=True).start()
+
+    def wait_until_ready(self, timeout=None):
+        self._loaded.wait(timeout)
+        return self.status == "ready"
+
+    def classify_faces(self, faces):
+        """Classifies a list of BGR face crops in a single forward pass.
+
+        Faces are passed the way DeepFace.analyze passes them (224x224 BGR scaled to
+        [0, 1]); the client does its own grayscale/resize. Returns one {label: percentage}
+        dict per face.
+        """
+        batch = np.stack([cv2.resize(face, EMOTION_INPUT_SIZE) for face in faces]).astype(np.float32) / 255.0
+        # A batch of one comes back as a single prediction vector
+        predictions = np.atleast_2d(self._classifier.predict(batch))
+        scores = []
+        for prediction in predictions:
+            total = float(prediction.sum()) or 1.0
+            scores.append({label: 100 * float(p) / total for label, p in zip(EMOTION_LABELS, prediction)})
+        return scores
+
+    def analyze_batch(self, frames):
+        """Gates each frame on the face detector and classifies the face crops in one batch.
+
+        Frames without a face get {'status': 'no_face'} and skip the emotion network.
+        """
+        boxes = [self._detector.detect(frame) for frame in frames]
+        faces = []
+        for frame, box in zip(frames, boxes):
+            if box is not None:
+                x, y, w, h = box
+                faces.append(cv2.resize(frame[y:y + h, x:x + w], FACE_CROP_SIZE, interpolation=cv2.INTER_AREA))
+        scores = iter(self.classify_faces(faces) if faces else [])
+        results = []
+        for box in boxes:
+            if box is None:
+                results.append({'status': 'no_face', 'dominant_emotion': None, 'emotion': {}, 'region': None})
+                continue
+            x, y, w, h = box
+            face_scores = next(scores)
+            results.append({
+                'status': 'ok',
+                'dominant_emotion': max(face_scores, key=face_scores.get),
+                'emotion': face_scores,
+                'region': {'x': x, 'y': y, 'w': w, 'h': h},
+            })
+        return results
+
+    def health(self):
+        return {
+            'status': self.status,
+            'ready': self.status == "ready",
+            'load_seconds': self.load_seconds,
+            'error': self.error,
+        }
+
+
+if __name__ == "__main__":
+    model = EmotionModel()
+    model.load()
+    print(model.health())
+    raise SystemExit(0 if model.status == "ready" else 1)
@@ -0,0 +1,86 @@
+"""Per-client temporal smoothing of /emotion results.
+
+Each webcam client gets a small ring buffer of its recent emotion probabilities and
+an exponentially smoothed estimate. Once the smoothed emotion has held for a few
+frames the client is told how long it may wait before sending the next frame
+(`skip_next_ms`), growing while the state stays steady and dropping back to zero
+as soon as it changes.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class ClientEmotionState:
+    def __init__(self, window):
+        self.recent = deque(maxlen=window)  # raw {label: percentage} dicts, newest last
+        self.smoothed = {}
+        self.stable_emotion = None
+        self.streak = 0  # consecutive updates with the same smoothed emotion
+        self.touched = time.monotonic()
+
+
+class EmotionTracker:
+    """Tracks smoothed emotion per client key with LRU/TTL eviction of idle clients."""
+
+    def __init__(self, alpha=0.3, window=10, steady_after=4, base_skip_ms=500, max_skip_ms=8000,
+                 max_clients=10000, ttl=600):
+        self.alpha = alpha
+        self.window = window
+        self.steady_after = steady_after
+        self.base_skip_ms = base_skip_ms
+        self.max_skip_ms = max_skip_ms
+        self.max_clients = max_clients
+        self.ttl = ttl
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _state(self, key):
+        now = time.monotonic()
+        state = self._clients.get(key)
+        if state is None or now - state.touched > self.ttl:
+            state = self._clients[key] = ClientEmotionState(self.window)
+        state.touched = now
+        self._clients.move_to_end(key)
+        while len(self._clients) > self.max_clients:
+            self._clients.popitem(last=False)
+        return state
+
+    def update(self, key, scores):
+        """Folds a new frame's scores (or None when no face was seen) into the client's state."""
+        with self._lock:
+            state = self._state(key)
+            if scores:
+                state.recent.append(scores)
+                if not state.smoothed:
+                    state.smoothed = dict(scores)
+                else:
+                    state.smoothed = {
+                        label: self.alpha * scores.get(label, 0.0) + (1 - self.alpha) * state.smoothed.get(label, 0.0)
+                        for label in set(scores) | set(state.smoothed)
+                    }
+                emotion = max(state.smoothed, key=state.smoothed.get)
+                if emotion == state.stable_emotion:
+                    state.streak += 1
+                else:
+                    state.stable_emotion = emotion
+                    state.streak = 1
+            else:
+                # Nobody in front of the camera is also a state worth backing off on
+                state.streak = state.streak + 1 if state.stable_emotion is None else 0
+                state.stable_emotion = None
+            return self._summary(state)
+
+    def _summary(self, state):
+        steady = state.streak >= self.steady_after
+        skip_next_ms = 0
+        if steady:
+            skip_next_ms = min(self.max_skip_ms, self.base_skip_ms * 2 ** min(state.streak - self.steady_after, 16))
+        confidence = state.smoothed.get(state.stable_emotion, 0.0) if state.stable_emotion else 0.0
+        return {
+            'stable_emotion': state.stable_emotion,
+            'confidence': round(confidence, 2),
+            'steady': steady,
+            'skip_next_ms': int(skip_next_ms),
+            'frames': len(state.recent),
+        }
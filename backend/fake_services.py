@@ -0,0 +1,240 @@
+"""Local stand-ins for Gemini, Google Custom Search, YouTube and the emotion model.
+
+Used by loadtest.py so the backend can be driven without network access or API
+quota. Each fake has configurable latency, so a run measures our own overhead
+on top of upstream calls that behave like the real ones:
+
+- `install_fake_genai()` registers a fake `google.generativeai` module whose
+  models answer after a first-token delay and stream tokens at a fixed rate.
+- `FakeGoogleAPIs` is an HTTP server for /customsearch/v1 and /youtube/v3/search;
+  point GOOGLE_API_BASE_URL at it.
+- `install_fake_emotion_model()` registers a fake `emotion_model` module with a
+  fixed per-batch and per-frame inference cost.
+
+They must be installed before newback is imported.
+
+    python fake_services.py --port 8089   # just the Google API fake, for another process
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+WORDS = (
+    "python list function loop variable class object method value index string dictionary "
+    "iterate return argument example module recursion condition error exception"
+).split()
+
+
+# --- Gemini ---
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGemini:
+    """Shared latency settings for every fake model."""
+
+    def __init__(self, first_token_ms=400, tokens_per_second=80, reply_tokens=250, seed=None):
+        self.first_token_ms = first_token_ms
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.random = random.Random(seed)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def reply(self, prompt, max_tokens):
+        with self._lock:
+            self.calls += 1
+            count = min(self.reply_tokens, max_tokens)
+            return [self.random.choice(WORDS) for _ in range(count)]
+
+    def token_delay(self):
+        return 1 / self.tokens_per_second if self.tokens_per_second else 0
+
+
+class FakeChatSession:
+    def __init__(self, model, history):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content, stream=False):
+        words = self.model.fake.reply(content, self.model.max_tokens)
+        self.history.append({'role': 'user', 'parts': [content]})
+        self.history.append({'role': 'model', 'parts': [" ".join(words)]})
+        if stream:
+            return self._stream(words)
+        time.sleep(self.model.fake.first_token_ms / 1000 + len(words) * self.model.fake.token_delay())
+        return FakeResponse(" ".join(words))
+
+    def _stream(self, words):
+        time.sleep(self.model.fake.first_token_ms / 1000)
+        for start in range(0, len(words), 8):
+            time.sleep(8 * self.model.fake.token_delay())
+            yield FakeResponse(" ".join(words[start:start + 8]) + " ")
+
+
+def install_fake_genai(fake):
+    """Registers a fake google.generativeai module backed by `fake` and returns it."""
+    class GenerativeModel:
+        def __init__(self, model_name=None, generation_config=None, system_instruction=None, **kwargs):
+            self.fake = fake
+            self.model_name = model_name
+            self.system_instruction = system_instruction
+            self.max_tokens = (generation_config or {}).get('max_output_tokens', 8192)
+
+        def start_chat(self, history=None):
+            return FakeChatSession(self, history)
+
+        def generate_content(self, content, **kwargs):
+            words = fake.reply(content, self.max_tokens)
+            time.sleep(fake.first_token_ms / 1000 + len(words) * fake.token_delay())
+            return FakeResponse(" ".join(words))
+
+        async def generate_content_async(self, content, **kwargs):
+            words = fake.reply(content, self.max_tokens)
+            await asyncio.sleep(fake.first_token_ms / 1000 + len(words) * fake.token_delay())
+            return FakeResponse(" ".join(words))
+
+    module = types.ModuleType("google.generativeai")
+    module.configure = lambda **kwargs: None
+    module.GenerativeModel = GenerativeModel
+    google = sys.modules.get("google")
+    if google is None:
+        google = sys.modules["google"] = types.ModuleType("google")
+        google.__path__ = []
+    google.generativeai = module
+    sys.modules["google.generativeai"] = module
+    return module
+
+
+# --- Custom Search and YouTube ---
+class FakeGoogleAPIs:
+    """Serves canned Custom Search image results and YouTube search results over HTTP."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=150):
+        self.latency_ms = latency_ms
+        self.calls = {'customsearch': 0, 'youtube': 0}
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query).get('q', [''])[0]
+                if url.path == "/customsearch/v1":
+                    body = fake.image_results(query, int(parse_qs(url.query).get('num', ['3'])[0]))
+                    fake.calls['customsearch'] += 1
+                elif url.path == "/youtube/v3/search":
+                    body = fake.video_results(query)
+                    fake.calls['youtube'] += 1
+                else:
+                    self.send_error(404)
+                    return
+                time.sleep(fake.latency_ms / 1000)
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-google-apis", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    @staticmethod
+    def image_results(query, num):
+        return {'items': [{
+            'link': f"https://images.example.com/{abs(hash(query)) % 10000}/{i}.png",
+            'title': f"{query} diagram {i}",
+            'snippet': f"A diagram of {query}",
+            'displayLink': "images.example.com",
+            'image': {'thumbnailLink': f"https://images.example.com/thumb/{i}.png", 'width': 640, 'height': 480},
+        } for i in range(num)]}
+
+    @staticmethod
+    def video_results(query):
+        return {'items': [{
+            'id': {'videoId': f"vid{abs(hash(query)) % 100000:05d}{i}"},
+            'snippet': {'title': f"{query} explained, part {i + 1}"},
+        } for i in range(5)]}
+
+
+# --- Emotion model ---
+def install_fake_emotion_model(batch_ms=15, frame_ms=2):
+    """Registers a fake emotion_model module whose model is ready at once and costs
+    batch_ms + frame_ms per frame for each batch."""
+    labels = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+
+    class EmotionModel:
+        status = "ready"
+
+        def build(self):
+            pass
+
+        def start_loading(self):
+            pass
+
+        def wait_until_ready(self, timeout=None):
+            return True
+
+        def analyze_batch(self, frames):
+            time.sleep((batch_ms + frame_ms * len(frames)) / 1000)
+            results = []
+            for frame in frames:
+                scores = {label: random.random() for label in labels}
+                total = sum(scores.values())
+                scores = {label: 100 * value / total for label, value in scores.items()}
+                results.append({
+                    'status': 'ok',
+                    'dominant_emotion': max(scores, key=scores.get),
+                    'emotion': scores,
+                    'region': {'x': 10, 'y': 10, 'w': 100, 'h': 100},
+                })
+            return results
+
+        def health(self):
+            return {'status': self.status, 'ready': True, 'load_seconds': 0.0, 'error': None}
+
+    module = types.ModuleType("emotion_model")
+    module.EmotionModel = EmotionModel
+    module.decode_image = lambda data: data or None
+    sys.modules["emotion_model"] = module
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the fake Custom Search / YouTube server on its own.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=150)
+    args = parser.parse_args()
+    apis = FakeGoogleAPIs(args.host, args.port, args.latency_ms)
+    print(f"Fake Google APIs on {apis.base_url} (set GOOGLE_API_BASE_URL to this)")
+    apis.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""Quota-aware scheduling for Gemini calls.
+
+Every Gemini call goes through one GeminiScheduler per process. Before a call is
+admitted it must get a concurrency slot, a request from the requests-per-minute
+bucket and its estimated tokens from the tokens-per-minute bucket. Waiting calls
+are admitted strictly by priority class, then in arrival order, so interactive
+tutor replies go ahead of background work like concept extraction. A few
+concurrency slots are also kept free for interactive calls.
+
+Rate-limit and transient server errors are retried with full-jitter exponential
+backoff. A 429 also pauses admission for everyone, so a burst slows down instead
+of failing request by request. Calls that can't be admitted within their class's
+wait limit, or that still fail after the last retry, raise GeminiUnavailable.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+from per_process import PerProcess
+
+log = logging.getLogger(__name__)
+
+INTERACTIVE = 0  # tutor replies the student is waiting on
+BACKGROUND = 1   # enrichment: concept extraction for image/video search
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+RETRYABLE_NAMES = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+                   "DeadlineExceeded", "GatewayTimeout"}
+
+
+class GeminiUnavailable(Exception):
+    """Gemini couldn't be reached within quota: admission timed out or retries ran out."""
+
+
+def is_retryable(error):
+    code = getattr(error, "code", None)
+    return code in RETRYABLE_STATUS or type(error).__name__ in RETRYABLE_NAMES
+
+
+def is_rate_limited(error):
+    return getattr(error, "code", None) == 429 or type(error).__name__ in ("ResourceExhausted", "TooManyRequests")
+
+
+def used_tokens(response):
+    """Total tokens Gemini reports for a response, if it reports any."""
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) or None
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` (capped at the bucket size) is available."""
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount):
+        # May go negative when a call used more than estimated; later calls pay it back
+        self.level -= amount
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "tokens", "wake", "granted", "abandoned")
+
+    def __init__(self, priority, seq, tokens, wake):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.wake = wake
+        self.granted = False
+        self.abandoned = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class GeminiScheduler:
+    def __init__(self, requests_per_minute=2000, tokens_per_minute=4_000_000, max_concurrency=32,
+                 reserved_interactive=4, max_retries=3, base_delay=1.0, max_delay=20.0,
+                 max_wait=None):
+        self.max_concurrency = max_concurrency
+        self.reserved_interactive = min(reserved_interactive, max_concurrency - 1)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait or {INTERACTIVE: 30.0, BACKGROUND: 120.0}
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._waiters = []  # heap of _Waiter
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+        self._dispatcher = PerProcess(self._start_dispatcher)
+        self.retries = 0
+        self.rate_limited = 0
+        self.rejected = 0
+
+    # --- Admission ---
+    def _start_dispatcher(self):
+        # A condition inherited across a fork may still list the parent's waiting threads
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._in_flight = 0
+        dispatcher = threading.Thread(target=self._run_dispatcher, name="gemini-dispatcher", daemon=True)
+        dispatcher.start()
+        return dispatcher
+
+    def _run_dispatcher(self):
+        with self._cond:
+            while True:
+                self._cond.wait(self._dispatch())
+
+    def _dispatch(self):
+        """Admits waiters in priority order; returns how long until the head could be admitted
+        (None: until a slot is released). Called with the lock held."""
+        now = time.monotonic()
+        self._requests.refill(now)
+        self._tokens.refill(now)
+        while self._waiters:
+            head = self._waiters[0]
+            if head.abandoned:
+                heapq.heappop(self._waiters)
+                continue
+            if now < self._paused_until:
+                return self._paused_until - now
+            limit = self.max_concurrency
+            if head.priority != INTERACTIVE:
+                limit -= self.reserved_interactive
+            if self._in_flight >= limit:
+                return None
+            wait = max(self._requests.wait_time(1), self._tokens.wait_time(head.tokens))
+            if wait > 0:
+                return wait
+            heapq.heappop(self._waiters)
+            self._requests.take(1)
+            self._tokens.take(head.tokens)
+            self._in_flight += 1
+            head.granted = True
+            head.wake()
+        return None
+
+    def _enqueue(self, priority, tokens, wake):
+        self._dispatcher.get()
+        waiter = _Waiter(priority, next(self._seq), tokens, wake)
+        with self._cond:
+            heapq.heappush(self._waiters, waiter)
+            self._cond.notify()
+        return waiter
+
+    def _abandon(self, waiter):
+        """Withdraws a waiter that gave up; returns False if it was admitted in the meantime."""
+        with self._cond:
+            if waiter.granted:
+                return False
+            waiter.abandoned = True
+            self.rejected += 1
+            return True
+
+    def _acquire(self, priority, tokens):
+        admitted = threading.Event()
+        waiter = self._enqueue(priority, tokens, admitted.set)
+        if not admitted.wait(self.max_wait[priority]) and self._abandon(waiter):
+            raise GeminiUnavailable("Gemini is at its request quota; try again shortly")
+        return waiter
+
+    async def _acquire_async(self, priority, tokens):
+        loop = asyncio.get_running_loop()
+        admitted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: admitted.done() or admitted.set_result(None))
+
+        waiter = self._enqueue(priority, tokens, wake)
+        try:
+            await asyncio.wait_for(asyncio.shield(admitted), self.max_wait[priority])
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                raise GeminiUnavailable("Gemini is at its request quota; try again shortly")
+        except asyncio.CancelledError:
+            if not self._abandon(waiter):
+                self._release(waiter)
+            raise
+        return waiter
+
+    def _release(self, waiter, tokens=None):
+        with self._cond:
+            self._in_flight -= 1
+            if tokens is not None:
+                self._tokens.take(tokens - waiter.tokens)
+            self._cond.notify()
+
+    # --- Retries ---
+    def _backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        with self._cond:
+            self.retries += 1
+            if is_rate_limited(error):
+                self.rate_limited += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                self._cond.notify()
+        log.warning("Gemini call failed (%s), retrying in %.1fs", error, delay)
+        return delay
+
+    def _give_up(self, attempt, error):
+        return not is_retryable(error) or attempt == self.max_retries
+
+    def call(self, fn, priority=INTERACTIVE, tokens=1000):
+        """Runs `fn()` (a blocking Gemini call) once admitted, retrying transient failures."""
+        for attempt in itertools.count():
+            waiter = self._acquire(priority, tokens)
+            try:
+                response = fn()
+            except Exception as e:
+                self._release(waiter)
+                if self._give_up(attempt, e):
+                    if is_retryable(e):
+                        raise GeminiUnavailable(str(e)) from e
+                    raise
+                time.sleep(self._backoff(attempt, e))
+                continue
+            self._release(waiter, used_tokens(response))
+            return response
+
+    async def call_async(self, fn, priority=BACKGROUND, tokens=1000):
+        """Async version of call(): awaits `fn()` (returning a coroutine) once admitted."""
+        for attempt in itertools.count():
+            waiter = await self._acquire_async(priority, tokens)
+            try:
+                response = await fn()
+            except Exception as e:
+                self._release(waiter)
+                if self._give_up(attempt, e):
+                    if is_retryable(e):
+                        raise GeminiUnavailable(str(e)) from e
+                    raise
+                await asyncio.sleep(self._backoff(attempt, e))
+                continue
+            except asyncio.CancelledError:
+                self._release(waiter)
+                raise
+            self._release(waiter, used_tokens(response))
+            return response
+
+    def stream(self, fn, priority=INTERACTIVE, tokens=1000):
+        """Yields the chunks of a streaming call `fn()`, holding its slot until the stream ends.
+        Only failures before the first chunk are retried."""
+        for attempt in itertools.count():
+            waiter = self._acquire(priority, tokens)
+            yielded = False
+            try:
+                for chunk in fn():
+                    yielded = True
+                    yield chunk
+                return
+            except Exception as e:
+                if yielded or self._give_up(attempt, e):
+                    if is_retryable(e) and not yielded:
+                        raise GeminiUnavailable(str(e)) from e
+                    raise
+                error = e
+            finally:
+                self._release(waiter)
+            time.sleep(self._backoff(attempt, error))
+
+    def stats(self):
+        with self._cond:
+            queued = {INTERACTIVE: 0, BACKGROUND: 0}
+            for waiter in self._waiters:
+                if not waiter.abandoned:
+                    queued[waiter.priority] = queued.get(waiter.priority, 0) + 1
+            return {
+                'in_flight': self._in_flight,
+                'queued_interactive': queued[INTERACTIVE],
+                'queued_background': queued[BACKGROUND],
+                'retries': self.retries,
+                'rate_limited': self.rate_limited,
+                'rejected': self.rejected,
+            }
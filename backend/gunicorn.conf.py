@@ -0,0 +1,44 @@
+"""Gunicorn settings for the Flask backend. Every value can be overridden from the environment.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+
+# Each worker holds its own copy of anything not shared copy-on-write, so keep the
+# process count near the core count and get I/O concurrency from threads: most
+# request time is spent waiting on Gemini and Google APIs.
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 16))
+# The Gemini quota is per project; each worker's scheduler takes an equal share of it
+os.environ.setdefault("GEMINI_PROCESSES", str(workers))
+
+# Gemini replies can take a while; streaming responses keep the connection busy too
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+
+# Recycle workers now and then to bound slow leaks; 0 disables it
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 50))
+
+# Import the app and its heavy modules once in the master, then fork; the emotion
+# model is built in each worker by post_fork, since TensorFlow isn't fork-safe
+preload_app = os.getenv("PRELOAD_MODELS", "1") == "1"
+os.environ["PRELOAD_MODELS"] = "1" if preload_app else "0"
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-")
+
+
+def post_fork(server, worker):
+    import newback
+    newback.init_worker()
+
+
+def worker_exit(server, worker):
+    # Write out chat turns still queued before the worker goes away
+    import newback
+    newback.shutdown_worker()
@@ -0,0 +1,274 @@
+"""Load generator for the Flask backend, with Gemini and Google APIs faked locally.
+
+By default the app is started in this process on a throwaway SQLite database.
+Gemini, Custom Search, YouTube and the emotion model are replaced by the fakes
+in fake_services.py. Worker threads then replay a weighted mix of /chat,
+/history, /emotion and /create-session traffic for a fixed time. The report
+gives throughput and p50/p95/p99 latency per route.
+
+    python loadtest.py --duration 60 --concurrency 32
+    python loadtest.py --json run.json                        # save the results
+    python loadtest.py --baseline run.json --max-regression 0.2   # exit 1 if any p95 got >20% slower
+    python loadtest.py --target http://staging:5000           # drive an already running backend
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+
+DEFAULT_MIX = "chat=50,history=30,emotion=15,create-session=5"
+
+QUESTIONS = [
+    "What is a list comprehension?",
+    "How do I loop over a dictionary?",
+    "Can you explain recursion with an example?",
+    "What's the difference between a tuple and a list?",
+    "Why does my function return None?",
+    "How do classes and objects work in Python?",
+]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f"Unknown operations in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+# --- In-process app with fakes ---
+def start_local_backend(args):
+    """Installs the fakes, imports newback against a temporary SQLite file and serves it."""
+    import fake_services
+    from werkzeug.serving import make_server
+
+    workdir = tempfile.mkdtemp(prefix="samaveda-loadtest-")
+    apis = fake_services.FakeGoogleAPIs(latency_ms=args.google_latency_ms).start()
+    os.environ.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        'GEMINI_API_KEY': 'fake', 'GOOGLE_CSE_API_KEY': 'fake', 'GOOGLE_CSE_CX': 'fake', 'YOUTUBE_API_KEY': 'fake',
+        'GOOGLE_API_BASE_URL': apis.base_url,
+        'PRELOAD_MODELS': '0',
+        'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+    })
+    gemini = fake_services.FakeGemini(args.gemini_first_token_ms, args.gemini_tokens_per_second,
+                                      args.gemini_reply_tokens, seed=args.seed)
+    fake_services.install_fake_genai(gemini)
+    if not args.real_emotion:
+        fake_services.install_fake_emotion_model(args.emotion_batch_ms, args.emotion_frame_ms)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import newback
+    app = newback.create_app()
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="loadtest-server", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", {'gemini': gemini, 'google_apis': apis}
+
+
+# --- Traffic ---
+class Scenario:
+    """Users and sessions created up front, shared by all workers."""
+
+    def __init__(self, client, users, sessions_per_user, image):
+        self.image = image
+        self.sessions = []  # (user_id, session_name)
+        run = uuid.uuid4().hex[:8]
+        for u in range(users):
+            user_id = f"load-{run}-{u}"
+            client.post("/register", json={'user_id': user_id, 'password': 'x'}).raise_for_status()
+            if u % 2:
+                client.post("/save-score", json={'user_id': user_id, 'iqscore': str(random.choice([75, 95, 120]))})
+            for s in range(sessions_per_user):
+                session_name = f"session-{s}"
+                client.post("/create-session", data={'user_id': user_id, 'session_name': session_name,
+                                                     'study_mode': 'learn'}).raise_for_status()
+                self.sessions.append((user_id, session_name))
+
+
+def op_chat(client, scenario, rng):
+    user_id, session_name = rng.choice(scenario.sessions)
+    return client.post("/chat", json={'message': rng.choice(QUESTIONS), 'user_id': user_id,
+                                      'sessionName': session_name})
+
+
+def op_history(client, scenario, rng):
+    user_id, session_name = rng.choice(scenario.sessions)
+    return client.get(f"/history/{user_id}", params={'sessionName': session_name, 'limit': 50})
+
+
+def op_emotion(client, scenario, rng):
+    user_id, _ = rng.choice(scenario.sessions)
+    return client.post("/emotion", files={'image': ('frame.jpg', scenario.image, 'image/jpeg')},
+                       data={'client_id': f"{user_id}-cam"})
+
+
+def op_create_session(client, scenario, rng):
+    user_id, _ = rng.choice(scenario.sessions)
+    return client.post("/create-session", data={'user_id': user_id, 'session_name': f"extra-{uuid.uuid4().hex[:12]}",
+                                                'study_mode': 'learn'})
+
+
+OPERATIONS = {
+    'chat': op_chat,
+    'history': op_history,
+    'emotion': op_emotion,
+    'create-session': op_create_session,
+}
+
+
+def worker(base_url, scenario, mix, deadline, seed, results, lock):
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    with httpx.Client(base_url=base_url, timeout=60) as client:
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                response = OPERATIONS[name](client, scenario, rng)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            elapsed = time.perf_counter() - started
+            if failed:
+                errors[name] += 1
+            else:
+                samples[name].append(elapsed)
+    with lock:
+        for name, values in samples.items():
+            results['samples'][name].extend(values)
+        for name, count in errors.items():
+            results['errors'][name] += count
+
+
+def summarize(results, seconds):
+    summary = {}
+    for name in sorted(set(results['samples']) | set(results['errors'])):
+        values = sorted(results['samples'][name])
+        summary[name] = {
+            'requests': len(values),
+            'errors': results['errors'][name],
+            'throughput': len(values) / seconds,
+            'p50_ms': percentile(values, 0.50) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+        }
+    everything = sorted(v for values in results['samples'].values() for v in values)
+    summary['all'] = {
+        'requests': len(everything),
+        'errors': sum(results['errors'].values()),
+        'throughput': len(everything) / seconds,
+        'p50_ms': percentile(everything, 0.50) * 1000,
+        'p95_ms': percentile(everything, 0.95) * 1000,
+        'p99_ms': percentile(everything, 0.99) * 1000,
+    }
+    return summary
+
+
+def report(summary):
+    print(f"  {'route':<16} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, row in summary.items():
+        print(f"  {name:<16} {row['requests']:>9} {row['errors']:>7} {row['throughput']:>8.1f} "
+              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+
+
+def compare(summary, baseline, max_regression):
+    """Returns the routes whose p95 is more than max_regression slower than the baseline's."""
+    regressions = []
+    for name, row in summary.items():
+        before = baseline.get(name, {}).get('p95_ms')
+        if before and row['requests'] and row['p95_ms'] > before * (1 + max_regression):
+            regressions.append(f"{name}: p95 {before:.1f} ms -> {row['p95_ms']:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", help="base URL of a running backend; by default one is started with fakes")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of traffic")
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weighted operations, e.g. chat=50,history=30")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--sessions-per-user", type=int, default=2)
+    parser.add_argument("--image", help="JPEG sent to /emotion (needed with --real-emotion)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the summary to this file")
+    parser.add_argument("--baseline", help="summary JSON from an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed p95 slowdown vs --baseline")
+    fakes = parser.add_argument_group("fakes (in-process backend only)")
+    fakes.add_argument("--gemini-first-token-ms", type=float, default=400)
+    fakes.add_argument("--gemini-tokens-per-second", type=float, default=80)
+    fakes.add_argument("--gemini-reply-tokens", type=int, default=250)
+    fakes.add_argument("--google-latency-ms", type=float, default=150)
+    fakes.add_argument("--emotion-batch-ms", type=float, default=15)
+    fakes.add_argument("--emotion-frame-ms", type=float, default=2)
+    fakes.add_argument("--real-emotion", action="store_true", help="use the real DeepFace model for /emotion")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    random.seed(args.seed)
+    fakes_in_use = {}
+    if args.target:
+        base_url = args.target.rstrip("/")
+    else:
+        base_url, fakes_in_use = start_local_backend(args)
+    image = open(args.image, "rb").read() if args.image else random.randbytes(20 * 1024)
+
+    print(f"Preparing {args.users} users x {args.sessions_per_user} sessions on {base_url} ...")
+    with httpx.Client(base_url=base_url, timeout=60) as client:
+        scenario = Scenario(client, args.users, args.sessions_per_user, image)
+
+    print(f"Running {args.concurrency} clients for {args.duration:.0f} s, mix {args.mix}")
+    results = {'samples': defaultdict(list), 'errors': defaultdict(int)}
+    lock = threading.Lock()
+    started = time.monotonic()
+    deadline = started + args.duration
+    threads = [
+        threading.Thread(target=worker, args=(base_url, scenario, mix, deadline, args.seed + i, results, lock))
+        for i in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = summarize(results, time.monotonic() - started)
+    report(summary)
+    if fakes_in_use:
+        print(f"Fake upstream calls: gemini={fakes_in_use['gemini'].calls} "
+              f"google={fakes_in_use['google_apis'].calls}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(summary, json.load(f), args.max_regression)
+        if regressions:
+            print("Latency regressions against the baseline:")
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print("No p95 regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
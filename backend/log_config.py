@@ -0,0 +1,58 @@
+"""Logging setup: level from LOG_LEVEL, records written by a background thread.
+
+Request threads only put records on a bounded queue and a listener thread writes
+them to stderr, so a slow terminal or log pipe never stalls a request.
+If the queue is full the record is dropped and counted instead of waiting. The
+listener is started on first use in each process.
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+from per_process import PerProcess
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s"
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, target, max_queued=10000):
+        super().__init__(queue.Queue(max_queued))
+        self.target = target
+        self.max_queued = max_queued
+        self.dropped = 0
+        self._listener = PerProcess(self._start_listener)
+
+    def _start_listener(self):
+        self.queue = queue.Queue(self.max_queued)
+        listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+        listener.start()
+        pid = os.getpid()
+        # Flush what's queued on a clean exit; atexit hooks are inherited across forks
+        atexit.register(lambda: os.getpid() == pid and listener.stop())
+        return listener
+
+    def enqueue(self, record):
+        self._listener.get()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(level=None):
+    """Routes the root logger through a BackgroundQueueHandler at LOG_LEVEL (default INFO)."""
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    target = logging.StreamHandler(sys.stderr)
+    target.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler = BackgroundQueueHandler(target)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if isinstance(existing, BackgroundQueueHandler):
+            root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
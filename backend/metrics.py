@@ -0,0 +1,221 @@
+"""In-process metrics in the Prometheus text format, plus per-request timing spans.
+
+Request handlers wrap each stage in `span("stage")`. The elapsed time goes into the
+`stage_seconds` histogram, labelled with the route of the request being traced,
+and into that request's trace, which the app reports in a `Server-Timing` header
+and its request log line. Outbound API calls are wrapped in `outbound("service")`.
+
+Metrics are kept per process. Under gunicorn every worker exposes its own values,
+so scrape each worker or add them up in the query.
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name + "_total", self.labelnames, labels, value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        names = self.labelnames + ("le",)
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                yield self.name + "_bucket", names, labels + (str(bound),), cumulative
+            yield self.name + "_bucket", names, labels + ("+Inf",), values[-1]
+            yield self.name + "_sum", self.labelnames, labels, values[-2]
+            yield self.name + "_count", self.labelnames, labels, values[-1]
+
+
+class GaugeCallback:
+    """A gauge read at scrape time: `collect()` returns {label values tuple: value}."""
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames, collect):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in sorted(self.collect().items()):
+            yield self.name, self.labelnames, labels, value
+
+
+class Registry:
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self._metrics = []
+
+    def _add(self, metric):
+        metric.name = self.prefix + metric.name
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def gauge_callback(self, name, help, labelnames, collect):
+        return self._add(GaugeCallback(name, help, labelnames, collect))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample_name, names, labels, value in metric.samples():
+                lines.append(f"{sample_name}{_format_labels(names, labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry(prefix="samaveda_")
+
+request_seconds = registry.histogram(
+    "request_seconds", "Time to produce a response, by route", ("route", "method", "status"))
+requests_total = registry.counter("requests", "Responses sent, by route and status", ("route", "method", "status"))
+stage_seconds = registry.histogram("stage_seconds", "Time spent in each stage of a request", ("route", "stage"))
+outbound_seconds = registry.histogram("outbound_seconds", "Latency of outbound API calls", ("service",))
+outbound_calls = registry.counter("outbound_calls", "Outbound API calls, by outcome", ("service", "outcome"))
+
+
+# --- Request traces ---
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.stages = []  # (stage, seconds) in completion order
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages)
+
+
+def start_trace(route):
+    trace = Trace(route)
+    _trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _trace.get()
+
+
+def end_trace():
+    _trace.set(None)
+
+
+@contextmanager
+def span(stage):
+    """Times a block as a stage of the current request (or of `background` work)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        trace = _trace.get()
+        stage_seconds.observe(seconds, trace.route if trace else "background", stage)
+        if trace is not None:
+            trace.stages.append((stage, seconds))
+
+
+class OutboundCall:
+    def __init__(self):
+        self.outcome = "ok"
+
+    def failed(self, outcome="error"):
+        self.outcome = outcome
+
+
+@contextmanager
+def outbound(service):
+    """Times an outbound call and counts it by outcome; exceptions count as errors.
+    Mark a call that returned an error response with `call.failed()`."""
+    call = OutboundCall()
+    started = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call.failed()
+        raise
+    finally:
+        outbound_seconds.observe(time.perf_counter() - started, service)
+        outbound_calls.inc(service, call.outcome)
+
+
+def watch_caches(caches):
+    """Exposes hit ratios and sizes of caches that report `stats()`; caches maps name -> cache."""
+    def stat(key):
+        return lambda: {(name,): cache.stats()[key] for name, cache in caches.items()}
+
+    registry.gauge_callback("cache_hit_ratio", "Share of cache lookups served from the cache", ("cache",),
+                            stat('hit_ratio'))
+    registry.gauge_callback("cache_entries", "Entries held in memory by each cache", ("cache",), stat('entries'))
@@ -1,27 +1,61 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text, and_, or_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from dotenv import load_dotenv
 import os
 import google.generativeai as genai
 from datetime import datetime, timezone
 from flask_cors import CORS
-import requests
+import asyncio
+import httpx
 import re # Keep re for potential future use or if other parts rely on it
-from deepface import DeepFace
-import tempfile
-import fitz  # PyMuPDF
-from werkzeug.utils import secure_filename
-import os
-
-# NEW imports for speech
-import speech_recognition as sr
-import pyttsx3
+import json
+import math
+import functools
+import importlib
+import threading
+import base64
+import gzip
+import io
+import multiprocessing
+import time
+import logging
+import atexit
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from werkzeug.formparser import FormDataParser
+
+from conversation_cache import ConversationCache, estimate_tokens
+from result_cache import ResultCache
+from concept_extractor import ConceptExtractor
+from outbound_io import OutboundIO
+from per_process import PerProcess
+from write_behind import IdAllocator, WriteBehindQueue
+from gemini_client import GeminiScheduler, GeminiUnavailable, INTERACTIVE, BACKGROUND
+from emotion_batcher import MicroBatcher
+from emotion_tracker import EmotionTracker
+from user_profile_cache import UserProfile, UserProfileCache
+from answer_cache import AnswerCache, hashed_embedding, iq_band, is_context_free
+from session_index import SessionIndexCache, build_index
+from tts_service import TTSService
+from speech_to_text import Transcriber, get_recognizer, read_wav
+from log_config import configure_logging
+import metrics
+from metrics import span, outbound
+
+try:
+    import brotli  # optional: preferred over gzip for /history when installed
+except ImportError:
+    brotli = None
 
 load_dotenv()
+log_handler = configure_logging()
+log = logging.getLogger(__name__)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GOOGLE_CSE_API_KEY = os.getenv("GOOGLE_CSE_API_KEY")  # New API key for Custom Search
 GOOGLE_CSE_CX = os.getenv("GOOGLE_CSE_CX")  # Custom Search Engine ID
 YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY") # Load YouTube API key from .env
+GOOGLE_API_BASE_URL = os.getenv("GOOGLE_API_BASE_URL", "https://www.googleapis.com")  # overridden by the load test fakes
 
 if not GEMINI_API_KEY:
     raise ValueError("GEMINI_API_KEY not found in .env file")
@@ -34,22 +68,57 @@ if not YOUTUBE_API_KEY: # Check for YouTube API key as well
 
 genai.configure(api_key=GEMINI_API_KEY)
 
+# All Gemini calls are admitted through one scheduler per process. The quota is
+# project-wide, so each process gets its share (gunicorn.conf.py sets GEMINI_PROCESSES).
+GEMINI_PROCESSES = max(1, int(os.getenv("GEMINI_PROCESSES", 1)))
+gemini = GeminiScheduler(
+    requests_per_minute=int(os.getenv("GEMINI_RPM", 2000)) / GEMINI_PROCESSES,
+    tokens_per_minute=int(os.getenv("GEMINI_TPM", 4_000_000)) / GEMINI_PROCESSES,
+    max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", 32)),
+    reserved_interactive=int(os.getenv("GEMINI_RESERVED_INTERACTIVE", 4)),
+    max_retries=int(os.getenv("GEMINI_MAX_RETRIES", 3))
+)
+GEMINI_REPLY_TOKENS = int(os.getenv("GEMINI_REPLY_TOKENS", 1000))  # expected tutor reply size, for the token budget
+GEMINI_RETRY_AFTER = 5  # seconds suggested to clients when Gemini is at quota
+
 app = Flask(__name__)
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL not found in .env file")
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
-db = SQLAlchemy(app)
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+# Engine options must be set before SQLAlchemy(app) creates the engine
+engine_options = {
     'pool_recycle': 300,
     'pool_pre_ping': True
 }
+if not DATABASE_URL.startswith('sqlite'):
+    # Per worker process; size it to at least the worker's thread count
+    engine_options.update({
+        'pool_size': int(os.getenv("DB_POOL_SIZE", 10)),
+        'max_overflow': int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        'pool_timeout': int(os.getenv("DB_POOL_TIMEOUT", 30)),
+    })
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+db = SQLAlchemy(app)
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
 
+# Heavy subsystems (DeepFace/TensorFlow, PyMuPDF, speech) are imported on first use.
+# PRELOAD_MODELS=1 imports them at import time instead; gunicorn.conf.py sets it when the
+# app is preloaded in the master so forked workers share the modules copy-on-write. The
+# emotion model itself is built in each worker: TensorFlow state doesn't survive a fork.
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS") == "1"
+
 # --- Speech Engine setup ---
-engine = pyttsx3.init()
-engine.setProperty('rate', 150)  # Speed of speech
-engine.setProperty('volume', 1)  # Volume (0.0 to 1.0)
+# Renders speech to WAV for the client; pyttsx3 is loaded by the engine's worker thread
+tts_service = TTSService(
+    rate=150,  # Speed of speech
+    volume=1,  # Volume (0.0 to 1.0)
+    max_entries=int(os.getenv("TTS_CACHE_ENTRIES", 256)),
+    max_bytes=int(os.getenv("TTS_CACHE_MB", 64)) * 1024 * 1024
+)
+TTS_TIMEOUT = float(os.getenv("TTS_TIMEOUT", 30))  # seconds a request waits for its audio
+TTS_MAX_CHARS = int(os.getenv("TTS_MAX_CHARS", 5000))
+TTS_CHUNK_BYTES = 64 * 1024
 
 # --- Models ---
 
@@ -77,8 +146,16 @@ class Session(db.Model):
     user_portion = db.Column(db.Text, nullable=True)
     ai_portion = db.Column(db.Text, nullable=True)
     percentage_of_completion = db.Column(db.Float, nullable=True)
+    ingest_status = db.Column(db.String(20), nullable=True)  # processing / ready / failed for uploaded material
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
+    __table_args__ = (
+        # One session name per user; also serves lookups by (user_id, session_name)
+        db.Index('uq_session_user_name', 'user_id', 'session_name', unique=True),
+        # /get-sessions: a user's sessions, newest first
+        db.Index('ix_session_user_time', 'user_id', 'timestamp'),
+    )
+
 # --- Chat Table ---
 class Chat(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -87,16 +164,157 @@ class Chat(db.Model):
     user_message = db.Column(db.Text, nullable=True)
     bot_response = db.Column(db.Text, nullable=False)
     image_url = db.Column(db.String(300), nullable=True)
+    images = db.Column(db.Text, nullable=True)  # JSON list of related images, NULL while still being fetched
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
-with app.app_context():
+    __table_args__ = (
+        # /chat and /history: a session's turns in order
+        db.Index('ix_chat_user_session_time', 'user_id', 'session_name', 'timestamp'),
+    )
+
+# --- Id Block Table ---
+# Chat ids are reserved here on databases without sequences (see reserve_chat_ids)
+class IdBlock(db.Model):
+    __tablename__ = 'id_block'
+    name = db.Column(db.String(50), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False)
+
+# Columns added after the tables were first created; db.create_all() only creates missing tables.
+ADDED_COLUMNS = {
+    'chat': {'images': 'TEXT'},
+    'session': {'ingest_status': 'VARCHAR(20)'},
+}
+
+def add_missing_columns():
+    """Adds any ADDED_COLUMNS that an existing database doesn't have yet."""
+    inspector = inspect(db.engine)
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        for name, column_type in columns.items():
+            if name not in existing:
+                with db.engine.begin() as conn:
+                    conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}'))
+
+def add_missing_indexes():
+    """Creates model indexes that an existing database doesn't have yet (db.create_all() skips
+    tables that already exist). A unique index fails if the table already holds duplicates; that
+    is reported and left for the operator to clean up."""
+    for model in (Session, Chat):
+        for index in model.__table__.indexes:
+            try:
+                index.create(bind=db.engine, checkfirst=True)
+            except SQLAlchemyError as e:
+                log.warning("Could not create index %s: %s", index.name, e)
+
+def init_db():
+    """Creates missing tables, columns and indexes. Needs an app context."""
     db.create_all()
+    add_missing_columns()
+    add_missing_indexes()
+
+# --- Chat Write-Behind ---
+# Chat turns are queued and inserted in batches by a writer thread, one transaction
+# per batch instead of one per turn. Ids and timestamps are assigned when a turn is
+# queued, but the request that saved a turn waits for its batch to commit before it
+# responds, so whichever worker serves the client's next read sees the turn. Reads
+# in this process of a session's turns and of a single turn also flush the matching
+# queued rows (turns from background work, or ones that outlasted the wait).
+CHAT_FLUSH_TIMEOUT = 10  # seconds a request waits for queued turns to be written
+
+def reserve_chat_ids(count):
+    """Reserves `count` Chat ids. PostgreSQL hands them out from the table's own sequence;
+    other databases count them in the id_block table, starting after the largest existing id."""
+    for attempt in range(2):
+        try:
+            with db.engine.begin() as conn:
+                if db.engine.dialect.name == 'postgresql':
+                    rows = conn.execute(text("SELECT nextval(pg_get_serial_sequence('chat', 'id')) "
+                                             "FROM generate_series(1, :count)"), {'count': count})
+                    return [row[0] for row in rows]
+                blocks = IdBlock.__table__
+                updated = conn.execute(blocks.update().where(blocks.c.name == 'chat')
+                                       .values(next_value=blocks.c.next_value + count))
+                if updated.rowcount:
+                    end = conn.execute(db.select(blocks.c.next_value).where(blocks.c.name == 'chat')).scalar()
+                    return range(end - count, end)
+                start = (conn.execute(db.select(db.func.max(Chat.__table__.c.id))).scalar() or 0) + 1
+                conn.execute(blocks.insert().values(name='chat', next_value=start + count))
+                return range(start, start + count)
+        except IntegrityError:
+            # Another process created the counter row first
+            if attempt:
+                raise
+
+def insert_chat_rows(rows):
+    """Writes a batch of queued Chat rows in one transaction."""
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(Chat.__table__.insert(), rows)
+
+# Ids only need to be unique: turns are ordered and synced by (timestamp, id), so each
+# process can take a block of them at a time
+chat_ids = IdAllocator(reserve_chat_ids, block_size=int(os.getenv("CHAT_ID_BLOCK", 20)))
+chat_writer = WriteBehindQueue(
+    insert_chat_rows,
+    max_batch=int(os.getenv("CHAT_WRITE_BATCH", 200)),
+    max_wait_ms=int(os.getenv("CHAT_WRITE_DELAY_MS", 50)),
+    name="chat-writer"
+)
+
+def save_chat_turn(user_id, session_name, user_message, bot_response):
+    """Queues a chat turn, waits for its batch to be committed and returns it as a Chat that
+    isn't attached to the db session. Raises if the row couldn't be written."""
+    # Naive UTC, as the database hands timestamps back, so cursors built from either compare alike
+    chat = Chat(id=chat_ids.next(), user_id=user_id, session_name=session_name, user_message=user_message,
+                bot_response=bot_response, timestamp=datetime.now(timezone.utc).replace(tzinfo=None))
+    committed = chat_writer.add({column.name: getattr(chat, column.name) for column in Chat.__table__.columns})
+    try:
+        committed.result(timeout=CHAT_FLUSH_TIMEOUT)
+    except FutureTimeoutError:
+        # Still queued: this process's reads flush it, other workers see it once it lands
+        log.warning("Chat %s not written after %ss, responding anyway", chat.id, CHAT_FLUSH_TIMEOUT)
+    return chat
+
+def flush_session_chats(user_id, session_name):
+    """Writes the session's queued turns now, before they are read back."""
+    chat_writer.flush(lambda row: row['user_id'] == user_id and row['session_name'] == session_name,
+                      timeout=CHAT_FLUSH_TIMEOUT)
+
+def flush_chat(chat_id):
+    chat_writer.flush(lambda row: row['id'] == chat_id, timeout=CHAT_FLUSH_TIMEOUT)
+
+# --- Search Result Caches ---
+SEARCH_CACHE_DB = os.getenv("SEARCH_CACHE_DB")  # optional SQLite file shared across workers
+image_search_cache = ResultCache(
+    'images',
+    max_entries=int(os.getenv("SEARCH_CACHE_SIZE", 1024)),
+    ttl=int(os.getenv("SEARCH_CACHE_TTL", 86400)),
+    negative_ttl=int(os.getenv("SEARCH_CACHE_NEGATIVE_TTL", 600)),
+    sqlite_path=SEARCH_CACHE_DB
+)
+video_search_cache = ResultCache(
+    'videos',
+    max_entries=int(os.getenv("SEARCH_CACHE_SIZE", 1024)),
+    ttl=int(os.getenv("SEARCH_CACHE_TTL", 86400)),
+    negative_ttl=int(os.getenv("SEARCH_CACHE_NEGATIVE_TTL", 600)),
+    sqlite_path=SEARCH_CACHE_DB
+)
+
+# --- Outbound I/O (shared event loop + pooled HTTP client) ---
+outbound_io = OutboundIO(
+    max_connections=int(os.getenv("OUTBOUND_MAX_CONNECTIONS", 200)),
+    timeout=float(os.getenv("OUTBOUND_TIMEOUT", 10))
+)
 
 # --- Helper Functions ---
-def search_images_google_cse(query, num_results=3):
-    """Search for images using Google Custom Search Engine API based on a generated query"""
+async def search_images_google_cse_async(query, num_results=3):
+    """Searches for images with the Google Custom Search API; runs on the outbound I/O loop."""
+    cache_key = f"{query}|{num_results}"
+    cached = image_search_cache.get(cache_key)
+    if cached is not None:
+        return cached
     try:
-        url = "https://www.googleapis.com/customsearch/v1"
+        url = f"{GOOGLE_API_BASE_URL}/customsearch/v1"
         params = {
             'key': GOOGLE_CSE_API_KEY,
             'cx': GOOGLE_CSE_CX,
@@ -110,10 +328,13 @@ def search_images_google_cse(query, num_results=3):
             'rights': 'cc_publicdomain,cc_attribute,cc_sharealike,cc_noncommercial,cc_nonderived'
         }
         
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        
-        data = response.json()
+        with outbound('google_cse') as call:
+            ok, data = await outbound_io.get_json(url, params=params)
+            if not ok:
+                call.failed()
+        if not ok:
+            log.error("Error searching images: %s", data.get('error', data))
+            return []
         
         images = []
         if 'items' in data:
@@ -129,27 +350,25 @@ def search_images_google_cse(query, num_results=3):
                 }
                 images.append(image_info)
         
+        image_search_cache.set(cache_key, images)
         return images
         
-    except requests.exceptions.RequestException as e:
-        print(f"Error searching images: {e}")
+    except httpx.HTTPError as e:
+        log.error("Error searching images: %s", e)
         return []
-    except Exception as e:
-        print(f"Unexpected error in image search: {e}")
+    except Exception:
+        log.exception("Unexpected error in image search")
         return []
 
-def get_relevant_images_for_response(bot_response):
-    """Extracts the core concept using Gemini, then builds a precise search query."""
-    try:
-        # Step 1: Use Gemini to extract core concept only
-        concept_extractor = genai.GenerativeModel(
-            model_name="gemini-2.0-flash",
-            generation_config={
-                "temperature": 0.2,
-                "max_output_tokens": 15,
-                "response_mime_type": "text/plain",
-            },
-            system_instruction="""
+# --- Concept Extraction (shared by image search and /extract-concept) ---
+concept_model = genai.GenerativeModel(
+    model_name="gemini-2.0-flash",
+    generation_config={
+        "temperature": 0.2,
+        "max_output_tokens": 15,
+        "response_mime_type": "text/plain",
+    },
+    system_instruction="""
 You are a concept extractor. Your job is to read a programming explanation and respond with the **core concept only**, in 1–3 words.
 Examples:
 - 'This code defines and uses a Python class to represent a Dog.' -> 'class'
@@ -157,33 +376,85 @@ Examples:
 - 'Explain recursion with base and recursive case.' -> 'recursion'
 - 'In Python, dictionaries store key-value pairs.' -> 'dictionary'
 """
-        )
+)
 
-        concept_chat = concept_extractor.start_chat(history=[])
-        concept_response = concept_chat.send_message(bot_response)
-        concept = concept_response.text.strip().lower()
-        print(f"[ImageSearch] Core Concept: '{concept}'")
+async def extract_concept_async(text):
+    async def generate():
+        with outbound('gemini_concept'):
+            return await concept_model.generate_content_async(text)
 
-        # Step 2: Build query string using template
-        query = f"{concept} in Python diagram"
-        print(f"[ImageSearch] Final Image Query: '{query}'")
+    response = await gemini.call_async(generate, BACKGROUND, tokens=estimate_tokens(text) + 200)
+    return response.text
 
-        return search_images_google_cse(query, num_results=3)
+concept_extractor = ConceptExtractor(
+    extract_concept_async,
+    outbound_io.run,
+    max_entries=int(os.getenv("CONCEPT_CACHE_SIZE", 2048))
+)
+
+def get_relevant_images_for_response(bot_response):
+    """Extracts the core concept using Gemini, then builds a precise search query."""
+    return outbound_io.run(get_relevant_images_for_response_async(bot_response))
+
+async def get_relevant_images_for_response_async(bot_response, prefetch_videos=False):
+    """Async version of get_relevant_images_for_response. With prefetch_videos, the YouTube
+    search for the same concept runs concurrently, so a later /search-video is a cache hit."""
+    try:
+        # Step 1: Use Gemini to extract core concept only
+        with span('concept'):
+            concept = await concept_extractor.extract_async(bot_response)
+
+        # Step 2: Build query string using template
+        query = f"{concept.lower()} in Python diagram"
+        log.debug("Image search query for concept %r: %r", concept.lower(), query)
+
+        with span('image_search'):
+            if not prefetch_videos:
+                return await search_images_google_cse_async(query, num_results=3)
+            images, _ = await asyncio.gather(
+                search_images_google_cse_async(query, num_results=3),
+                search_videos_async(concept),
+                return_exceptions=True
+            )
+        return images if isinstance(images, list) else []
 
     except Exception as e:
-        print(f"Error generating image search query: {e}")
+        log.error("Error generating image search query: %s", e)
         return []
 
+# --- Background Image Enrichment ---
+pending_enrichments = {}  # chat_id -> Future, for jobs started by this process
 
-        
-        # Search for images using the LLM-generated query
-        images = search_images_google_cse(generated_query, num_results=3)
-        
-        return images
-        
+def save_chat_images(chat_id, images):
+    try:
+        flush_chat(chat_id)
+        with app.app_context():
+            chat = db.session.get(Chat, chat_id)
+            if chat:
+                chat.images = json.dumps(images)
+                chat.image_url = images[0]['url'][:300] if images else None
+                db.session.commit()
     except Exception as e:
-        print(f"Error getting relevant images: {e}")
-        return []
+        log.error("Error saving images for chat %s: %s", chat_id, e)
+
+async def enrich_chat_images(chat_id, bot_response):
+    """Finds images for a saved bot response and stores them on its Chat row."""
+    images = await get_relevant_images_for_response_async(bot_response, prefetch_videos=True)
+    await outbound_io.to_thread(save_chat_images, chat_id, images)
+    return images
+
+def schedule_image_enrichment(chat_id, bot_response):
+    """Starts image enrichment on the outbound I/O loop and returns its Future."""
+    future = outbound_io.submit(enrich_chat_images(chat_id, bot_response))
+    pending_enrichments[chat_id] = future
+    future.add_done_callback(lambda _: pending_enrichments.pop(chat_id, None))
+    return future
+
+IMAGE_MAX_WAIT = 5  # seconds /chat/<id>/images may hold a request thread
+STREAM_IMAGES_TIMEOUT = float(os.getenv("STREAM_IMAGES_TIMEOUT", 15))  # seconds /chat/stream waits for images
+
+def stored_images(chat):
+    return json.loads(chat.images) if chat.images else []
 
 # --- User Authentication Routes ---
 def check_user_login(user_id, password):
@@ -244,6 +515,7 @@ def save_score():
         return jsonify({"error": "User not found"}, 404)
     user.iq_score = iqscore
     db.session.commit()
+    user_profiles.invalidate(user_id)
     return jsonify({"message": "IQ score saved successfully!"}), 200
 
 
@@ -264,14 +536,32 @@ def start_session():
         return jsonify({'error': f'Missing required fields: {missing_fields}'}), 400
 
     # Check if the session name already exists for the user
-    existing_session = Session.query.filter_by(user_id=user_id, session_name=session_name).first()
+    with span('duplicate_check'):
+        existing_session = db.session.query(Session.id).filter_by(user_id=user_id, session_name=session_name).first()
     if existing_session:
         return jsonify({'error': 'Session name already exists for this user'}), 409
 
-    # Extract text from PDF if file is provided
+    # Extract text from PDF if file is provided; large PDFs are processed in the background
     pdf_text = ""
+    pdf_path = None
+    ingest_in_background = False
     if file:
-        pdf_text = extract_text_from_pdf(file)
+        import pdf_ingest  # PyMuPDF is only loaded once a PDF arrives
+        with span('pdf_spool'):
+            pdf_path = pdf_ingest.spool_upload(file)
+        try:
+            ingest_in_background = pdf_ingest.page_count(pdf_path) >= PDF_BACKGROUND_PAGES
+            if not ingest_in_background:
+                with span('pdf_extract'):
+                    pdf_text = pdf_ingest.extract_text(pdf_path, pdf_process_pool.get())
+                with span('pdf_index'):
+                    session_indexes.put((user_id, session_name), build_index(pdf_text))
+        except Exception as e:
+            os.remove(pdf_path)
+            log.error("Error reading PDF: %s", e)
+            return jsonify({'error': 'Could not read the uploaded PDF'}), 400
+        if not ingest_in_background:
+            os.remove(pdf_path)
 
     # Save to DB
     new_session = Session(
@@ -279,23 +569,103 @@ def start_session():
         session_name=session_name,
         study_mode=study_mode,
         user_portion=pdf_text if pdf_text else None,
+        ingest_status='processing' if ingest_in_background else ('ready' if file else None),
         timestamp=datetime.now(timezone.utc)
     )
 
     db.session.add(new_session)
-    db.session.commit()
+    try:
+        with span('save'):
+            db.session.commit()
+    except IntegrityError:
+        # Lost a race with a concurrent request creating the same session
+        db.session.rollback()
+        if ingest_in_background:
+            os.remove(pdf_path)
+        return jsonify({'error': 'Session name already exists for this user'}), 409
+
+    # Drop any context cached for an earlier session under the same name
+    conversation_cache.invalidate((user_id, session_name))
+
+    if ingest_in_background:
+        pdf_job_pool.submit(ingest_session_pdf, new_session.id, user_id, session_name, pdf_path)
+        return jsonify({'message': 'Session created, study material is being processed', 'ingest_status': 'processing'}), 202
 
     return jsonify({'message': 'Session created successfully'}), 200
 
+# --- PDF Ingestion ---
+PDF_BACKGROUND_PAGES = int(os.getenv("PDF_BACKGROUND_PAGES", 100))  # PDFs this long are ingested in the background
+PDF_INGEST_PROCESSES = int(os.getenv("PDF_INGEST_PROCESSES", min(4, os.cpu_count() or 1)))
+def start_pdf_process_pool():
+    # Processes come from a forkserver: forking this multi-threaded process directly can deadlock them
+    return ProcessPoolExecutor(max_workers=PDF_INGEST_PROCESSES, mp_context=multiprocessing.get_context("forkserver"))
+
+pdf_process_pool = PerProcess(start_pdf_process_pool)
+pdf_job_pool = ThreadPoolExecutor(max_workers=int(os.getenv("PDF_INGEST_JOBS", 2)), thread_name_prefix="pdf-ingest")
 
+def ingest_session_pdf(session_id, user_id, session_name, pdf_path):
+    """Background job: extracts a spooled PDF, indexes it and stores the text on its Session row."""
+    import pdf_ingest
+    try:
+        with span('pdf_extract'):
+            pdf_text = pdf_ingest.extract_text(pdf_path, pdf_process_pool.get())
+        with span('pdf_index'):
+            session_indexes.put((user_id, session_name), build_index(pdf_text))
+        status = 'ready'
+    except Exception as e:
+        log.error("Error ingesting PDF for session %s: %s", session_id, e)
+        pdf_text, status = None, 'failed'
+    finally:
+        os.remove(pdf_path)
+    try:
+        with app.app_context():
+            session = db.session.get(Session, session_id)
+            if session:
+                session.user_portion = pdf_text or None
+                session.ingest_status = status
+                db.session.commit()
+    except Exception as e:
+        log.error("Error saving ingested PDF for session %s: %s", session_id, e)
 
-def extract_text_from_pdf(file_storage):
-    """Extracts text from uploaded PDF (FileStorage object)."""
-    text = ""
-    with fitz.open(stream=file_storage.read(), filetype="pdf") as doc:
-        for page in doc:
-            text += page.get_text()
-    return text.strip()
+# --- Retrieval over Session Material ---
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 3))
+session_indexes = SessionIndexCache(max_sessions=int(os.getenv("SESSION_INDEX_CACHE_SIZE", 256)))
+
+def load_session_material(user_id, session_name):
+    row = db.session.query(Session.user_portion).filter_by(user_id=user_id, session_name=session_name).first()
+    return row.user_portion if row else None
+
+def with_study_material(user_id, session_name, user_message):
+    """Prefixes the message with the session material chunks most relevant to it, if any."""
+    try:
+        index = session_indexes.get(
+            (user_id, session_name),
+            lambda: load_session_material(user_id, session_name)
+        )
+        matches = index.search(user_message, RETRIEVAL_TOP_K) if index else []
+    except Exception as e:
+        log.error("Error retrieving study material: %s", e)
+        matches = []
+    if not matches:
+        return user_message
+    excerpts = "\n\n".join(f"[{number}] {chunk}" for number, (chunk, _) in enumerate(matches, 1))
+    return (
+        "Relevant excerpts from the student's uploaded study material "
+        "(use them if they help answer the message):\n"
+        f"{excerpts}\n\nStudent's message: {user_message}"
+    )
+
+@app.route('/session-ingest-status', methods=['GET'])
+def session_ingest_status():
+    user_id = request.args.get('user_id')
+    session_name = request.args.get('session_name')
+    if not user_id or not session_name:
+        return jsonify({'error': 'Missing user_id or session_name'}), 400
+    # Only the status column; user_portion can be a whole textbook
+    session = db.session.query(Session.ingest_status).filter_by(user_id=user_id, session_name=session_name).first()
+    if not session:
+        return jsonify({'error': 'Session not found'}), 404
+    return jsonify({'session_name': session_name, 'ingest_status': session.ingest_status}), 200
 
 @app.route('/get-sessions', methods=['GET'])
 def get_sessions():
@@ -303,7 +673,10 @@ def get_sessions():
     if not user_id:
         return jsonify({'error': 'Missing user_id'}), 400
 
-    sessions = Session.query.filter_by(user_id=user_id).order_by(Session.timestamp.desc()).all()
+    # Only the listed columns; user_portion / ai_portion can be whole textbooks
+    sessions = db.session.query(Session.id, Session.session_name, Session.timestamp).filter_by(
+        user_id=user_id
+    ).order_by(Session.timestamp.desc()).all()
     session_list = [{
         'id': session.id,
         'name': session.session_name,
@@ -315,32 +688,19 @@ def get_sessions():
 def extract_concept_route():
     data = request.get_json()
     text = data.get('text')
-    system_instruction = (
-        "You are a youtube query producer,when some one sends you a query you have to read it ,understand it and just MENTION the core concept of entire query and nothing else.Only answer in not more than 5 words."
-    )    
     if not text:
         return jsonify({'error': 'Missing text'}), 400
     
     try:
-        dynamic_model = genai.GenerativeModel(
-            model_name="gemini-2.0-flash",
-            generation_config={
-                "temperature": 1,
-                "top_p": 0.95,
-                "top_k": 40,
-                "max_output_tokens": 8192,
-                "response_mime_type": "text/plain",
-            },
-            system_instruction=system_instruction
-        )
-        chat_session = dynamic_model.start_chat(history=[])
-        response = chat_session.send_message(text)
-        model_response = response.text
-        print(model_response)
+        # Usually the same bot message /chat already extracted a concept from, so this is a cache hit
+        model_response = concept_extractor.extract(text)
         return jsonify({'concept': model_response}), 200
     
+    except GeminiUnavailable as e:
+        log.warning("Concept extraction deferred: %s", e)
+        return jsonify({'error': 'The tutor is busy, please try again shortly'}), 503, {'Retry-After': str(GEMINI_RETRY_AFTER)}
     except Exception as e:
-        print(f"Error extracting concept: {e}")
+        log.error("Error extracting concept: %s", e)
         return jsonify({'error': f'Error extracting concept: {e}'}), 500
 
 # --- NEW: Image Search Route (This route is now less critical as image search is integrated into /chat) ---
@@ -367,14 +727,13 @@ def extract_concept_route():
 #         return jsonify({'error': f'Error searching images: {str(e)}'}), 500
 
 # --- YouTube Search Route ---
-YOUTUBE_SEARCH_URL = 'https://www.googleapis.com/youtube/v3/search'
-
-@app.route('/search-video', methods=['POST'])
-def search_video():
-    data = request.json
-    query = data.get('query', '')
-    print(f"your last bot message {query}")
+YOUTUBE_SEARCH_URL = f'{GOOGLE_API_BASE_URL}/youtube/v3/search'
 
+async def search_videos_async(query):
+    """Returns YouTube search items for the query, served from video_search_cache when possible."""
+    items = video_search_cache.get(query)
+    if items is not None:
+        return items
     params = {
         'part': 'snippet',
         'q': query,
@@ -382,9 +741,26 @@ def search_video():
         'type': 'video',
         'maxResults': 5  # Changed from 1 to 5 to get more options
     }
+    with outbound('youtube') as call:
+        ok, data = await outbound_io.get_json(YOUTUBE_SEARCH_URL, params=params)
+        if not ok:
+            call.failed()
+    items = data.get('items')
+    if ok:
+        video_search_cache.set(query, items or [])
+    return items
 
-    response = requests.get(YOUTUBE_SEARCH_URL, params=params)
-    items = response.json().get('items')
+@app.route('/search-video', methods=['POST'])
+def search_video():
+    data = request.json
+    query = data.get('query', '')
+
+    try:
+        with span('youtube_search'):
+            items = outbound_io.run(search_videos_async(query))
+    except (httpx.HTTPError, ValueError) as e:
+        log.error("Error searching videos: %s", e)
+        return jsonify({'error': 'Video search failed'}), 502
 
     if items:
         # Return the first video as the main suggestion and the rest as alternatives
@@ -425,34 +801,14 @@ generation_config = {
     "response_mime_type": "text/plain",
 }
 
-@app.route('/chat', methods=['POST'])
-def chat():
-    data = request.get_json()
-    user_message = data.get('message')
-    user_id = data.get('user_id')
-    session_name=data.get('sessionName')
-    print(user_id)
-    print(session_name)
-    print(user_message)
-    if not user_message or not user_id:
-        return jsonify({'error': 'Message or user_id missing'}), 400
-    if not session_name:
-        return jsonify({'error': 'Session Name Missing'}), 400
-    user = User.query.filter_by(user_id=user_id).first()
-    
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
+# Tutor prompts are defined once at import; only the per-user values are filled in,
+# and the rendered result is cached per user (see user_profiles below).
+DEFAULT_TUTOR_PROMPT = (
+    "You are a Python instructor. The user hasn't provided their IQ yet. "
+    "Iq is 80,now you can start teaching and remember to be polite."
+)
 
-    iq_score = user.iq_score
-    # Determine system instruction based on IQ score (or default if not set)
-    if iq_score is None:
-        system_instruction_value = (
-            "You are a Python instructor. The user hasn't provided their IQ yet. "
-            "Iq is 80,now you can start teaching and remember to be polite."
-        )
-    else:
-        iq_score = int(iq_score)
-        system_instruction_value = (f"""
+TUTOR_PROMPT_TEMPLATE = """
 ### Persona ###
 You are Lokesh, a friendly, patient, knowledgeable, and encouraging teacher. Ask the student what they want to learn and the purpose of the knowledge first. Then frame the portion of the lessons based on the purpose of the knowledge. Confirm the portion with the user before starting to teach. 
 Your primary goal is to help the user, {user_id}, learn the concepts effectively and build their confidence.
@@ -509,97 +865,653 @@ The user's provided IQ score is {iq_score}. Use this score ONLY to set the initi
 * Follow the defined frequency and rotation for Understanding Checks and Feedback Solicitation.
 * Do not provide direct answers to complex coding problems or assignments. Instead, guide {user_id} through the problem-solving process step-by-step, asking guiding questions, and helping them arrive at the solution themselves. Explain concepts needed to solve the problem.
 """
+
+def build_system_instruction(user_id, iq_score):
+    """Builds the tutor system instruction for a user based on their IQ score."""
+    # Determine system instruction based on IQ score (or default if not set)
+    if iq_score is None:
+        return DEFAULT_TUTOR_PROMPT
+    return TUTOR_PROMPT_TEMPLATE.format(user_id=user_id, iq_score=int(iq_score))
+
+user_profiles = UserProfileCache(
+    max_users=int(os.getenv("USER_PROFILE_CACHE_SIZE", 4096)),
+    ttl=int(os.getenv("USER_PROFILE_CACHE_TTL", 300))
+)
+
+def load_user_profile(user_id):
+    row = db.session.query(User.iq_score).filter_by(user_id=user_id).first()
+    if row is None:
+        return None
+    return UserProfile(user_id, row.iq_score, build_system_instruction(user_id, row.iq_score))
+
+def get_user_profile(user_id):
+    """Returns the user's cached profile and rendered tutor prompt, or None if the user doesn't exist."""
+    return user_profiles.get(user_id, lambda: load_user_profile(user_id))
+
+# --- Conversation Context Cache ---
+summary_model = genai.GenerativeModel(
+    model_name="gemini-2.0-flash",
+    generation_config={
+        "temperature": 0.2,
+        "max_output_tokens": 512,
+        "response_mime_type": "text/plain",
+    },
+    system_instruction=(
+        "You summarise a tutoring conversation between a Python instructor and a student. "
+        "Keep the topics already covered, the student's feedback on pace and difficulty, "
+        "their answers to understanding checks and what was planned next. "
+        "Reply with a compact summary of at most 200 words and nothing else."
+    )
+)
+
+def summarize_conversation(previous_summary, turns):
+    """Folds older turns (and any earlier summary) into a compact summary using Gemini."""
+    transcript = []
+    if previous_summary:
+        transcript.append(f"Earlier summary: {previous_summary}")
+    for user_message, bot_response in turns:
+        transcript.append(f"Student: {user_message}")
+        transcript.append(f"Instructor: {bot_response}")
+    prompt = "\n".join(transcript)
+
+    def generate():
+        with outbound('gemini_summary'):
+            return summary_model.generate_content(prompt)
+
+    response = gemini.call(generate, INTERACTIVE, tokens=estimate_tokens(prompt) + 512)
+    return response.text.strip()
+
+conversation_cache = ConversationCache(
+    max_sessions=int(os.getenv("CONVERSATION_CACHE_SIZE", 512)),
+    ttl=int(os.getenv("CONVERSATION_CACHE_TTL", 1800)),
+    token_budget=int(os.getenv("CONVERSATION_TOKEN_BUDGET", 16000)),
+    fold_to=float(os.getenv("CONVERSATION_FOLD_TO", 0.5)),
+    # Turns committed this much later than their timestamp (another worker's write-behind
+    # queue, a retried batch) are still picked up by the next sync
+    sync_overlap=int(os.getenv("CONVERSATION_SYNC_OVERLAP", 120)),
+    summarizer=summarize_conversation
+)
+
+def load_chat_turns_since(user_id, session_name, since):
+    """Returns (id, timestamp, user_message, bot_response) for the session's turns from `since` on."""
+    flush_session_chats(user_id, session_name)
+    query = db.session.query(Chat.id, Chat.timestamp, Chat.user_message, Chat.bot_response).filter(
+        Chat.user_id == user_id,
+        Chat.session_name == session_name
+    )
+    if since is not None:
+        query = query.filter(Chat.timestamp >= since)
+    rows = query.order_by(Chat.timestamp, Chat.id).all()
+    return [(row.id, utc_naive(row.timestamp), row.user_message, row.bot_response) for row in rows]
+
+def utc_naive(timestamp):
+    """Chat timestamps as the database returns them: naive, in UTC."""
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None) if timestamp.tzinfo else timestamp
+
+@functools.lru_cache(maxsize=256)
+def get_tutor_model(system_instruction_value):
+    """Returns a configured tutor model, reused across requests with the same instruction."""
+    return genai.GenerativeModel(
+        model_name="gemini-2.0-flash",
+        generation_config=generation_config,
+        system_instruction=system_instruction_value # Use the dynamically determined system instruction
+    )
+
+def start_tutor_chat(user_id, session_name, system_instruction_value):
+    """Opens a Gemini chat session on top of the session's (cached) conversation context.
+    Returns the session and the estimated tokens of its instruction and history."""
+    history = conversation_cache.history(
+        (user_id, session_name),
+        lambda since: load_chat_turns_since(user_id, session_name, since)
+    )
+    context_tokens = estimate_tokens(system_instruction_value) + sum(
+        estimate_tokens(part) for turn in history for part in turn["parts"]
+    )
+    return get_tutor_model(system_instruction_value).start_chat(history=history), context_tokens
+
+def tutor_request_tokens(context_tokens, prompt):
+    """Token budget reserved for one tutor reply: context, the new message and the expected reply."""
+    return context_tokens + estimate_tokens(prompt) + GEMINI_REPLY_TOKENS
+
+def remember_chat_turn(new_chat):
+    """Adds a freshly saved Chat row to the conversation cache."""
+    conversation_cache.append(
+        (new_chat.user_id, new_chat.session_name),
+        new_chat.id, utc_naive(new_chat.timestamp), new_chat.user_message, new_chat.bot_response
+    )
+
+# --- Answer Cache (opt-in) ---
+# First-turn and context-free questions get the same answer for every student in an
+# IQ band, so answers are reused across students. Personalisation is limited to the
+# student's name, which is swapped for a placeholder in the cached copy.
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED") == "1"
+ANSWER_CACHE_EMBEDDING = os.getenv("ANSWER_CACHE_EMBEDDING", "local")  # or "gemini"
+STUDENT_PLACEHOLDER = "\u27e8student\u27e9"
+
+def gemini_embedding(text):
+    """Question embedding from Gemini's embedding model (more robust to rephrasing than the local one)."""
+    def embed():
+        with outbound('gemini_embed'):
+            return genai.embed_content(model="models/text-embedding-004", content=text, task_type="semantic_similarity")
+    return gemini.call(embed, INTERACTIVE, tokens=estimate_tokens(text))['embedding']
+
+answer_cache = AnswerCache(
+    embed=gemini_embedding if ANSWER_CACHE_EMBEDDING == "gemini" else hashed_embedding,
+    dim=768 if ANSWER_CACHE_EMBEDDING == "gemini" else 512,
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.9)),
+    max_entries_per_band=int(os.getenv("ANSWER_CACHE_SIZE", 2048)),
+    ttl=int(os.getenv("ANSWER_CACHE_TTL", 86400))
 )
+
+def answer_cacheable(data, chat_session, prompt, user_message):
+    """Only questions whose answer doesn't depend on this student's session: nothing earlier
+    in the conversation it could refer to (or no back-references) and no study material."""
+    return (
+        ANSWER_CACHE_ENABLED and not data.get('fresh') and prompt == user_message
+        and (not chat_session.history or is_context_free(user_message))
+    )
+
+def cached_answer(profile, user_message):
+    try:
+        answer = answer_cache.get(iq_band(profile.iq_score), user_message)
+    except Exception as e:
+        log.error("Error looking up answer cache: %s", e)
+        return None
+    return answer.replace(STUDENT_PLACEHOLDER, profile.user_id) if answer is not None else None
+
+def cache_answer(profile, user_message, answer):
+    if len(profile.user_id) < 3:
+        return  # too short to tell the name apart from ordinary text
+    generic = re.sub(rf"(?<!\w){re.escape(profile.user_id)}(?!\w)", STUDENT_PLACEHOLDER, answer)
+    try:
+        answer_cache.put(iq_band(profile.iq_score), user_message, generic)
+    except Exception as e:
+        log.error("Error storing answer in cache: %s", e)
+
+def sse_event(event, payload):
+    """Formats a single server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@app.route('/chat', methods=['POST'])
+def chat():
+    data = request.get_json()
+    user_message = data.get('message')
+    user_id = data.get('user_id')
+    session_name=data.get('sessionName')
+    if not user_message or not user_id:
+        return jsonify({'error': 'Message or user_id missing'}), 400
+    if not session_name:
+        return jsonify({'error': 'Session Name Missing'}), 400
+    with span('profile'):
+        profile = get_user_profile(user_id)
+    
+    if not profile:
+        return jsonify({'error': 'User not found'}), 404
     
     # Retrieve chat history from the database for the specific user
     with app.app_context():
-        chat_history_db = Chat.query.filter_by(user_id=user_id,session_name=session_name).order_by(Chat.timestamp).all()
-        history = []
-        for chat in chat_history_db:
-            history.append({"role": "user", "parts": [chat.user_message]})
-            history.append({"role": "model", "parts": [chat.bot_response]})
-        
-        main_model = genai.GenerativeModel(
-            model_name="gemini-2.0-flash",
-            generation_config=generation_config,
-            system_instruction=system_instruction_value # Use the dynamically determined system instruction
-        )
-        print(f"User {user_id} IQ: {iq_score} | Using system instruction: {system_instruction_value}")
-        chat_session = main_model.start_chat(history=history)
-        response = chat_session.send_message(user_message)
-        model_response = response.text
+        with span('history'):
+            chat_session, context_tokens = start_tutor_chat(user_id, session_name, profile.system_instruction)
+        with span('retrieval'):
+            prompt = with_study_material(user_id, session_name, user_message)
+
+        def generate():
+            with outbound('gemini_chat'):
+                return chat_session.send_message(prompt)
+
+        cacheable = answer_cacheable(data, chat_session, prompt, user_message)
+        model_response = None
+        if cacheable:
+            with span('answer_cache'):
+                model_response = cached_answer(profile, user_message)
+        if model_response is None:
+            try:
+                # Unlike the search calls this blocks the request thread: the view is synchronous
+                # and the reply is needed before it can return, so /chat concurrency per worker is
+                # bounded by the gthread pool (GUNICORN_THREADS). /chat/stream has the same limit.
+                with span('generate'):
+                    response = gemini.call(generate, INTERACTIVE, tokens=tutor_request_tokens(context_tokens, prompt))
+                    model_response = response.text
+            except GeminiUnavailable as e:
+                log.warning("Tutor reply deferred: %s", e)
+                return jsonify({'error': 'The tutor is busy, please try again shortly'}), 503, {'Retry-After': str(GEMINI_RETRY_AFTER)}
+            if cacheable:
+                cache_answer(profile, user_message, model_response)
 
         # Store the new interaction in the database
-        new_chat = Chat(user_id=user_id,session_name=session_name, user_message=user_message, bot_response=model_response)
-        db.session.add(new_chat)
-        db.session.commit()
+        with span('save'):
+            new_chat = save_chat_turn(user_id, session_name, user_message, model_response)
+            remember_chat_turn(new_chat)
 
-        # Get relevant images for the bot response using the improved method
-        try:
-            relevant_images = get_relevant_images_for_response(model_response)
-        except Exception as e:
-            print(f"Error getting images for response: {e}")
-            relevant_images = []
+        # Images are fetched in the background; clients pick them up from /chat/<chat_id>/images
+        schedule_image_enrichment(new_chat.id, model_response)
 
         return jsonify({
             'response': model_response,
-            'images': relevant_images
+            'chat_id': new_chat.id,
+            'images': [],
+            'images_pending': True
         })
 
+@app.route('/chat/<int:chat_id>/images', methods=['GET'])
+def get_chat_images(chat_id):
+    """Returns the images found for a chat turn, optionally waiting up to `wait` seconds for them.
+
+    Only an enrichment running in this process can be waited on; when another worker
+    owns it the current state is returned at once and the client polls again later.
+    """
+    wait = request.args.get('wait', 0, type=float)
+    if not math.isfinite(wait):
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    wait = max(0.0, min(wait, IMAGE_MAX_WAIT))
+    future = pending_enrichments.get(chat_id)
+    if future is not None and wait > 0:
+        try:
+            future.result(timeout=wait)
+        except FutureTimeoutError:
+            pass
+        except Exception as e:
+            log.error("Error waiting for images of chat %s: %s", chat_id, e)
+
+    flush_chat(chat_id)
+    chat = db.session.query(Chat.images).filter(Chat.id == chat_id).first()
+    if chat is None:
+        # Neither queued here nor stored (turns are committed before their chat_id is returned)
+        return jsonify({'error': 'Chat not found'}), 404
+    if chat.images is None:
+        return jsonify({'status': 'pending', 'images': []}), 202
+    return jsonify({'status': 'ready', 'images': stored_images(chat)}), 200
+
+# --- Streaming Chat Route (Server-Sent Events) ---
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streams the tutor reply token by token, then sends the images as a trailing event.
+
+    Events: `token` ({text}) for each chunk, `done` ({chat_id, response}) once the
+    Chat row is saved, `images` ({images}, with `images_pending` if they took longer
+    than STREAM_IMAGES_TIMEOUT) and finally `end`. Failures are reported
+    as an `error` event since the status line has already been sent.
+    """
+    data = request.get_json()
+    user_message = data.get('message')
+    user_id = data.get('user_id')
+    session_name = data.get('sessionName')
+    if not user_message or not user_id:
+        return jsonify({'error': 'Message or user_id missing'}), 400
+    if not session_name:
+        return jsonify({'error': 'Session Name Missing'}), 400
+    with span('profile'):
+        profile = get_user_profile(user_id)
+    if not profile:
+        return jsonify({'error': 'User not found'}), 404
+
+    with span('history'):
+        chat_session, context_tokens = start_tutor_chat(user_id, session_name, profile.system_instruction)
+    with span('retrieval'):
+        prompt = with_study_material(user_id, session_name, user_message)
+
+    def send():
+        with outbound('gemini_chat'):
+            yield from chat_session.send_message(prompt, stream=True)
+
+    cacheable = answer_cacheable(data, chat_session, prompt, user_message)
+    with span('answer_cache'):
+        cached = cached_answer(profile, user_message) if cacheable else None
+
+    def reply_text():
+        if cached is not None:
+            yield cached
+            return
+        for chunk in gemini.stream(send, INTERACTIVE, tokens=tutor_request_tokens(context_tokens, prompt)):
+            if chunk.text:
+                yield chunk.text
+
+    def generate():
+        chunks = []
+        try:
+            for piece in reply_text():
+                chunks.append(piece)
+                yield sse_event('token', {'text': piece})
+        except GeminiUnavailable as e:
+            log.warning("Tutor reply deferred: %s", e)
+            yield sse_event('error', {'error': 'The tutor is busy, please try again shortly', 'retry_after': GEMINI_RETRY_AFTER})
+            return
+        except Exception as e:
+            log.error("Error streaming chat response: %s", e)
+            yield sse_event('error', {'error': f'Error generating response: {e}'})
+            return
+
+        model_response = "".join(chunks)
+        if cacheable and cached is None:
+            cache_answer(profile, user_message, model_response)
+
+        # Store the interaction only once the full reply is known
+        new_chat = save_chat_turn(user_id, session_name, user_message, model_response)
+        remember_chat_turn(new_chat)
+        yield sse_event('done', {'chat_id': new_chat.id, 'response': model_response})
+
+        try:
+            relevant_images = schedule_image_enrichment(new_chat.id, model_response).result(timeout=STREAM_IMAGES_TIMEOUT)
+        except FutureTimeoutError:
+            # Enrichment carries on in the background; the client picks it up from /chat/<chat_id>/images
+            yield sse_event('images', {'images': [], 'images_pending': True})
+        else:
+            yield sse_event('images', {'images': relevant_images})
+        yield sse_event('end', {})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 # --- Chat History ---
+HISTORY_MAX_PAGE_SIZE = 200
+COMPRESS_MIN_BYTES = 1024
+
+def encode_cursor(chat):
+    """Opaque keyset cursor for a Chat row's position in (timestamp, id) order."""
+    return base64.urlsafe_b64encode(f"{chat.timestamp.isoformat()}|{chat.id}".encode()).decode()
+
+def decode_cursor(cursor):
+    timestamp, chat_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(timestamp), int(chat_id)
+
+def history_entries(chats):
+    history = []
+    for chat in chats:
+        history.append({"role": "user", "text": chat.user_message})
+        history.append({"role": "model", "text": chat.bot_response, "images": stored_images(chat)})
+    return history
+
+def compressed(response):
+    """Compresses a response body with brotli or gzip when the client accepts it."""
+    accepted = request.headers.get('Accept-Encoding', '')
+    if response.status_code != 200 or response.direct_passthrough or len(response.get_data()) < COMPRESS_MIN_BYTES:
+        return response
+    if brotli is not None and 'br' in accepted:
+        response.set_data(brotli.compress(response.get_data()))
+        response.headers['Content-Encoding'] = 'br'
+    elif 'gzip' in accepted:
+        response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
 @app.route('/history/<user_id>', methods=['GET'])
 def get_chat_history(user_id):
-    print("hi")
+    """Returns a session's chat history.
+
+    Without paging parameters the whole history is returned as a list. With `limit`,
+    `before` and/or `after` it is paged on (timestamp, id): `before=<next_cursor>`
+    walks back through older turns and `after=<latest_cursor>` fetches only turns
+    newer than those the client already has. Responses carry an ETag, so an
+    unchanged page comes back as 304.
+    """
     with app.app_context():
         session_name = request.args.get('sessionName')
         if not session_name:
             return jsonify({'error': 'Missing sessionName'}), 400
+        paged = any(name in request.args for name in ('limit', 'before', 'after'))
         try:
-            chat_history_db = Chat.query.filter_by(user_id=user_id,session_name=session_name).order_by(Chat.timestamp).all()
-            history = []
-            for chat in chat_history_db:
-                # Assuming images are not stored in the DB for simplicity here,
-                # if you want them to persist, you'd need to add an 'images' field to Chat model.
-                # For now, frontend will fetch new images for past messages if needed,
-                # or you can extend the Chat model to store image URLs with each bot_response.
-                history.append({"role": "user", "text": chat.user_message})
-                history.append({"role": "model", "text": chat.bot_response, "images": []}) # Add empty images for history
+            before = decode_cursor(request.args['before']) if request.args.get('before') else None
+            after = decode_cursor(request.args['after']) if request.args.get('after') else None
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        limit = min(max(request.args.get('limit', 50, type=int), 1), HISTORY_MAX_PAGE_SIZE)
+
+        try:
+            flush_session_chats(user_id, session_name)
+            query = Chat.query.filter_by(user_id=user_id,session_name=session_name)
+            if not paged:
+                body = history_entries(query.order_by(Chat.timestamp, Chat.id).all())
+            else:
+                if before:
+                    query = query.filter(or_(Chat.timestamp < before[0], and_(Chat.timestamp == before[0], Chat.id < before[1])))
+                if after:
+                    query = query.filter(or_(Chat.timestamp > after[0], and_(Chat.timestamp == after[0], Chat.id > after[1])))
+                catching_up = after is not None and before is None
+                if catching_up:
+                    # Oldest new turns first, so the client can keep paging forward
+                    chats = query.order_by(Chat.timestamp, Chat.id).limit(limit + 1).all()
+                    has_more = len(chats) > limit
+                    chats = chats[:limit]
+                else:
+                    chats = query.order_by(Chat.timestamp.desc(), Chat.id.desc()).limit(limit + 1).all()
+                    has_more = len(chats) > limit
+                    chats = list(reversed(chats[:limit]))
+                body = {
+                    'messages': history_entries(chats),
+                    # Pass as `before` to fetch the page of older turns, if any
+                    'next_cursor': encode_cursor(chats[0]) if has_more and not catching_up else None,
+                    # Pass as `after` to fetch only turns newer than this page
+                    'latest_cursor': encode_cursor(chats[-1]) if chats else request.args.get('after'),
+                    'has_more_newer': has_more and catching_up
+                }
         except Exception as e: # Catch all exceptions during history fetch
-            print(f"Error fetching chat history for {user_id} and session {session_name}: {e}")
+            log.error("Error fetching chat history for %s and session %s: %s", user_id, session_name, e)
+            db.session.rollback()
             initial_bot_response = "Hello! I'm your Python instructor. What's your IQ level so I can tailor our learning?"
-            new_chat = Chat(user_id=user_id,session_name=session_name, user_message="", bot_response=initial_bot_response)
-            db.session.add(new_chat)
-            db.session.commit()
+            new_chat = save_chat_turn(user_id, session_name, "", initial_bot_response)
             history = [{"role": "model", "text": initial_bot_response, "images": []}] # Ensure history is a list
-        return jsonify(history)
+            body = {'messages': history, 'next_cursor': None, 'latest_cursor': encode_cursor(new_chat), 'has_more_newer': False} if paged else history
+
+        response = jsonify(body)
+        response.headers['Cache-Control'] = 'private, no-cache'  # cache, but revalidate with the ETag
+        # Weak: the same ETag covers the identity, gzip and brotli encodings of the body
+        response.add_etag(weak=True)
+        response.vary.add('Accept-Encoding')
+        response.make_conditional(request)
+        return compressed(response)
 
 
 # --- Speech to Text ---
-@app.route('/speech-to-text', methods=['GET'])
+STT_RECOGNIZER = os.getenv("STT_RECOGNIZER", "google")  # or "sphinx" to recognise offline
+STT_REQUEST_TIMEOUT = float(os.getenv("STT_REQUEST_TIMEOUT", 30))  # hard limit per request
+STT_MAX_AUDIO_SECONDS = float(os.getenv("STT_MAX_AUDIO_SECONDS", 120))
+STT_MAX_UPLOAD_BYTES = int(os.getenv("STT_MAX_UPLOAD_MB", 16)) * 1024 * 1024
+STT_READ_TIMEOUT = float(os.getenv("STT_READ_TIMEOUT", 10))  # seconds a streamed upload may stall
+STT_CHUNK_BYTES = 8192
+stt_pool = ThreadPoolExecutor(max_workers=int(os.getenv("STT_WORKERS", 8)), thread_name_prefix="stt")
+transcriber = Transcriber(
+    get_recognizer(STT_RECOGNIZER),
+    stt_pool,
+    deadline_seconds=STT_REQUEST_TIMEOUT,
+    max_audio_seconds=STT_MAX_AUDIO_SECONDS,
+    end_silence_ms=int(os.getenv("STT_END_SILENCE_MS", 600))
+)
+
+def read_limited_body(limit):
+    """Reads the request body, or returns None if it is longer than limit. Chunked uploads
+    have no Content-Length to check up front, so the read itself is bounded."""
+    if request.content_length and request.content_length > limit:
+        return None
+    body = request.stream.read(limit + 1)
+    return None if len(body) > limit else body
+
+def request_socket():
+    """The client socket behind the request body, where the server exposes it (gunicorn and the
+    Werkzeug dev server); None elsewhere."""
+    return request.environ.get('gunicorn.socket') or request.environ.get('werkzeug.socket')
+
+@app.route('/speech-to-text', methods=['POST'])
 def speech_to_text():
-    recognizer = sr.Recognizer()
-    with sr.Microphone() as source:
-        print("Listening for speech...")
-        audio = recognizer.listen(source)
+    """Transcribes a WAV clip recorded by the client (multipart `audio` field or the raw body)."""
+    body = read_limited_body(STT_MAX_UPLOAD_BYTES)
+    if body is None:
+        return jsonify({"error": "Audio upload is too large"}), 413
+    if request.mimetype == 'multipart/form-data':
+        _, _, files = FormDataParser().parse(io.BytesIO(body), request.mimetype, len(body), request.mimetype_params)
+        upload = files.get('audio')
+        body = upload.read() if upload else b""
+    try:
+        pcm, sample_rate = read_wav(body)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    chunks = (pcm[i:i + STT_CHUNK_BYTES] for i in range(0, len(pcm), STT_CHUNK_BYTES))
+    events = list(transcriber.transcribe(chunks, sample_rate))
+    final = events.pop()
+    errors = [event['error'] for event in events if 'error' in event]
+    if errors and not final['text']:
+        return jsonify({"error": f"Speech Recognition error: {errors[0]}"}), 502
+    if not final['text'] and final['timed_out']:
+        return jsonify({"error": "Speech recognition timed out"}), 504
+    if not final['text']:
+        return jsonify({"error": "Could not understand audio"}), 400
+    return jsonify({**final, "partials": events}), 200
+
+@app.route('/speech-to-text/stream', methods=['POST'])
+def speech_to_text_stream():
+    """Transcribes raw 16-bit mono PCM sent with chunked transfer encoding.
+
+    The sample rate is taken from `?sample_rate=` (default 16000). Events: `partial`
+    ({segment, start_ms, end_ms, text}) as each utterance is recognised, then `final`
+    ({text, segments, audio_ms, timed_out, truncated}).
+    """
+    try:
+        sample_rate = int(request.args.get('sample_rate', 16000))
+    except ValueError:
+        return jsonify({"error": "sample_rate must be an integer"}), 400
+    if not 8000 <= sample_rate <= 48000:
+        return jsonify({"error": "sample_rate must be between 8000 and 48000"}), 400
+
+    deadline = time.monotonic() + STT_REQUEST_TIMEOUT
+
+    def chunks():
+        # The transcriber checks its deadline between chunks; the socket timeout makes sure
+        # a client that stops sending can't hold this thread in a read past it
+        sock = request_socket()
+        previous = sock.gettimeout() if sock is not None else None
         try:
-            text = recognizer.recognize_google(audio)
-            print(f"Recognized: {text}")
-            return jsonify({"text": text}), 200
-        except sr.UnknownValueError:
-            return jsonify({"error": "Could not understand audio"}), 400
-        except sr.RequestError as e:
-            return jsonify({"error": f"Speech Recognition error: {e}"}), 500
+            while True:
+                if sock is not None:
+                    sock.settimeout(max(0.1, min(STT_READ_TIMEOUT, deadline - time.monotonic())))
+                try:
+                    chunk = request.stream.read(STT_CHUNK_BYTES)
+                except OSError as e:
+                    raise TimeoutError("the audio stream stalled") from e
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            if sock is not None:
+                sock.settimeout(previous)
+
+    def generate():
+        try:
+            for event in transcriber.transcribe(chunks(), sample_rate):
+                yield sse_event(event.pop('type'), event)
+        except Exception as e:
+            log.error("Error transcribing audio stream: %s", e)
+            yield sse_event('error', {'error': f'Speech recognition failed: {e}'})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 # --- Text to Speech ---
 @app.route('/text-to-speech', methods=['POST'])
 def text_to_speech():
+    """Returns the spoken text as a WAV file, streamed in chunks."""
     data = request.get_json()
-    text = data.get('text')
+    text = (data.get('text') or '').strip()
     if not text:
         return jsonify({"error": "No text provided"}), 400
-    engine.say(text)
-    engine.runAndWait()
-    return jsonify({"message": "Speech played successfully!"}), 200
+    if len(text) > TTS_MAX_CHARS:
+        return jsonify({"error": f"Text is longer than {TTS_MAX_CHARS} characters"}), 413
+    try:
+        rate = int(data.get('rate') or tts_service.rate)
+    except (TypeError, ValueError):
+        return jsonify({"error": "rate must be a number"}), 400
+    rate = min(max(rate, 80), 300)
+
+    try:
+        audio = tts_service.synthesize(text, voice=data.get('voice'), rate=rate, timeout=TTS_TIMEOUT)
+    except FutureTimeoutError:
+        return jsonify({"error": "Speech synthesis timed out"}), 504
+    except Exception as e:
+        log.error("Error synthesizing speech: %s", e)
+        return jsonify({"error": "Speech synthesis failed"}), 500
+
+    def chunks():
+        view = memoryview(audio)
+        for start in range(0, len(view), TTS_CHUNK_BYTES):
+            yield bytes(view[start:start + TTS_CHUNK_BYTES])
+
+    response = Response(chunks(), mimetype='audio/wav')
+    response.headers['Content-Length'] = str(len(audio))
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    return response
+
+@app.route('/text-to-speech/voices', methods=['GET'])
+def text_to_speech_voices():
+    try:
+        voices = tts_service.voices(timeout=TTS_TIMEOUT)
+    except Exception as e:
+        return jsonify({"error": f"Could not list voices: {e}"}), 500
+    return jsonify({"voices": [{"id": voice_id, "name": name} for voice_id, name in voices]})
+
+# --- Search Cache Stats (for debugging) ---
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'images': image_search_cache.stats(),
+        'videos': video_search_cache.stats(),
+        'concepts': concept_extractor.stats(),
+        'tts': tts_service.stats(),
+        'answers': answer_cache.stats(),
+        'chat_writer': chat_writer.stats()
+    })
+
+# --- Metrics ---
+metrics.watch_caches({
+    'images': image_search_cache,
+    'videos': video_search_cache,
+    'concepts': concept_extractor,
+    'tts': tts_service,
+    'answers': answer_cache,
+})
+metrics.registry.gauge_callback(
+    "gemini_scheduler", "Gemini admission state: in-flight and queued calls, retries, rejections", ("stat",),
+    lambda: {(name,): value for name, value in gemini.stats().items()}
+)
+metrics.registry.gauge_callback(
+    "chat_writer", "Write-behind queue for chat turns: queued and written rows, batches, failures", ("stat",),
+    lambda: {(name,): value for name, value in chat_writer.stats().items()}
+)
+metrics.registry.gauge_callback(
+    "log_records_dropped", "Log records dropped because the log queue was full", (),
+    lambda: {(): log_handler.dropped}
+)
+
+@app.before_request
+def start_request_trace():
+    metrics.start_trace(request.url_rule.rule if request.url_rule else 'unmatched')
+
+@app.after_request
+def record_request_metrics(response):
+    trace = metrics.current_trace()
+    if trace is None:
+        return response
+    seconds = trace.elapsed()
+    labels = (trace.route, request.method, str(response.status_code))
+    metrics.request_seconds.observe(seconds, *labels)
+    metrics.requests_total.inc(*labels)
+    if trace.stages:
+        response.headers['Server-Timing'] = trace.server_timing()
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("%s %s %s %.1fms %s", request.method, trace.route, response.status_code,
+                      seconds * 1000, trace.server_timing())
+    metrics.end_trace()
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint for this worker process."""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
 
 # --- Test Image Search Route (for debugging) ---
 @app.route('/test-image-search', methods=['GET'])
@@ -616,22 +1528,118 @@ def test_image_search():
     except Exception as e:
         return jsonify({'error': f'Test failed: {str(e)}'}), 500
     
+# --- Emotion Detection ---
+EMOTION_READY_TIMEOUT = float(os.getenv("EMOTION_READY_TIMEOUT", 5))  # seconds a request waits for warm-up
+
+EMOTION_REQUEST_TIMEOUT = float(os.getenv("EMOTION_REQUEST_TIMEOUT", 2))  # cap on queueing + inference per frame
+
+emotion_model = None
+emotion_model_lock = threading.Lock()
+
+def get_emotion_model():
+    """Creates the emotion model on first use and starts loading it in the background."""
+    global emotion_model
+    with emotion_model_lock:
+        if emotion_model is None:
+            from emotion_model import EmotionModel  # pulls in DeepFace / TensorFlow, OpenCV and MediaPipe
+            emotion_model = EmotionModel()
+        emotion_model.start_loading()
+        return emotion_model
+
+# Frames from concurrent webcam clients are classified together in one forward pass
+emotion_batcher = MicroBatcher(
+    lambda frames: get_emotion_model().analyze_batch(frames),
+    max_batch=int(os.getenv("EMOTION_BATCH_SIZE", 16)),
+    max_wait_ms=float(os.getenv("EMOTION_BATCH_WINDOW_MS", 20)),
+    name="emotion-batcher"
+)
+# Smoothed per-client state, so steady clients can be told to send fewer frames
+emotion_tracker = EmotionTracker(
+    alpha=float(os.getenv("EMOTION_SMOOTHING_ALPHA", 0.3)),
+    steady_after=int(os.getenv("EMOTION_STEADY_FRAMES", 4)),
+    max_skip_ms=int(os.getenv("EMOTION_MAX_SKIP_MS", 8000))
+)
+
 @app.route("/emotion", methods=["POST"])
 def emotion():
     file = request.files['image']
-    temp_path = tempfile.mktemp(suffix=".jpg")
-    file.save(temp_path)
+    model = get_emotion_model()
+    from emotion_model import decode_image
+    with span('decode'):
+        frame = decode_image(file.read())
+    if frame is None:
+        return jsonify({"emotion": "unknown", "error": "Could not decode image"}), 400
+    with span('model_ready'):
+        ready = model.wait_until_ready(EMOTION_READY_TIMEOUT)
+    if not ready:
+        return jsonify({"emotion": "unknown", "status": model.status}), 503
 
     try:
-        result = DeepFace.analyze(temp_path, actions=["emotion"], enforce_detection=False)
-        emotion = result[0]["dominant_emotion"]
+        with span('inference'):
+            result = emotion_batcher.submit(frame, timeout=EMOTION_REQUEST_TIMEOUT)
+    except FutureTimeoutError:
+        return jsonify({"emotion": "unknown", "error": "Emotion analysis timed out"}), 504
     except Exception as e:
-        print("DeepFace error:", str(e))
-        emotion = "unknown"
+        log.error("DeepFace error: %s", e)
+        return jsonify({"emotion": "unknown", "status": "error"})
+
+    client_key = request.form.get('client_id') or request.form.get('user_id') or request.remote_addr
+    with span('tracker'):
+        tracked = emotion_tracker.update(client_key, result["emotion"])
+
+    # No face: emotion is null so clients don't count the frame
+    return jsonify({
+        "emotion": result["dominant_emotion"],
+        "status": result["status"],
+        "face_box": result["region"],
+        **tracked
+    })
+
+@app.route("/emotion/health", methods=["GET"])
+def emotion_health():
+    if emotion_model is None:
+        # Loaded on the first /emotion request
+        return jsonify({'status': 'not_loaded', 'ready': False}), 503
+    health = emotion_model.health()
+    return jsonify(health), 200 if health['ready'] else 503
+
+# --- App Factory / Worker Setup ---
+def create_app():
+    """Prepares the database and returns the app; the entry point for wsgi.py / gunicorn."""
+    with app.app_context():
+        init_db()
+    return app
 
-    os.remove(temp_path)
-    return jsonify({"emotion":emotion})
+def init_worker():
+    """Per-process setup after a fork: drop DB connections inherited from the master
+    and start the background work that can't cross a fork."""
+    with app.app_context():
+        db.engine.dispose(close=False)
+    if emotion_model is not None:
+        emotion_model.start_loading()
+
+def shutdown_worker():
+    """Writes out the chat turns still queued; called when a worker exits."""
+    chat_writer.close(timeout=CHAT_FLUSH_TIMEOUT)
+
+atexit.register(shutdown_worker)
+
+def preload_models():
+    """Imports the heavy subsystems up front instead of on first use. The emotion model is
+    only created here; it is built and warmed up by start_loading() in each worker."""
+    global emotion_model
+    importlib.import_module("pdf_ingest")
+    importlib.import_module("speech_recognition")
+    from emotion_model import EmotionModel
+    with emotion_model_lock:
+        if emotion_model is None:
+            emotion_model = EmotionModel()
+
+if PRELOAD_MODELS:
+    preload_models()
 
 # --- Run App ---
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    if emotion_model is not None:
+        emotion_model.start_loading()
+    create_app().run(debug=os.getenv("FLASK_DEBUG", "1") == "1", threaded=True)
\ No newline at end of file
@@ -0,0 +1,58 @@
+"""Shared asyncio loop and pooled HTTP client for outbound API calls.
+
+Custom Search, YouTube and Gemini calls run as coroutines on a single event loop
+thread per process, so hundreds of them can be in flight without each one pinning
+a thread. Request handlers wait on a call with `run()`; background work (image
+enrichment) is handed to the loop with `submit()` and never blocks a thread. All
+HTTP calls share one `httpx.AsyncClient`, so connections and TLS sessions to
+googleapis.com are reused.
+"""
+import asyncio
+import threading
+
+import httpx
+
+from per_process import PerProcess
+
+
+class OutboundIO:
+    def __init__(self, max_connections=200, max_keepalive=50, timeout=10.0):
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self.timeout = timeout
+        self._client = None
+        self._loop = PerProcess(self._start_loop)
+
+    def _start_loop(self):
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run_loop():
+            asyncio.set_event_loop(loop)
+            self._client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run_loop, name="outbound-io", daemon=True).start()
+        ready.wait()
+        return loop
+
+    @property
+    def loop(self):
+        return self._loop.get()
+
+    def submit(self, coro):
+        """Schedules a coroutine on the I/O loop and returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Runs a coroutine on the I/O loop and blocks the calling thread until it finishes."""
+        return self.submit(coro).result(timeout)
+
+    async def get_json(self, url, params=None, timeout=None):
+        """GETs url and returns (ok, json body); raises httpx.HTTPError on transport errors."""
+        response = await self._client.get(url, params=params, timeout=timeout or self.timeout)
+        return response.is_success, response.json()
+
+    async def to_thread(self, func, *args):
+        """Runs blocking work (e.g. a DB write) from a coroutine without stalling the loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
@@ -0,0 +1,42 @@
+"""PDF ingestion for /create-session.
+
+Uploads are spooled to a temporary file in chunks instead of being read into
+memory, and PyMuPDF opens that file directly. Text is extracted in page ranges,
+optionally spread across a process pool (each worker opens the file itself), and
+the pieces are joined once at the end.
+"""
+import os
+import tempfile
+
+import fitz  # PyMuPDF
+
+
+def spool_upload(file_storage):
+    """Streams an uploaded FileStorage to a temporary .pdf file and returns its path."""
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    with os.fdopen(fd, "wb") as out:
+        file_storage.save(out)
+    return path
+
+
+def page_count(path):
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def extract_page_range(path, start, stop):
+    """Returns the text of pages [start, stop) of the PDF at path."""
+    with fitz.open(path) as doc:
+        return "".join(doc[number].get_text() for number in range(start, stop))
+
+
+def extract_text(path, pool=None, pages_per_task=25):
+    """Extracts the text of the whole PDF, fanning page ranges out to `pool` if given."""
+    pages = page_count(path)
+    ranges = [(start, min(start + pages_per_task, pages)) for start in range(0, pages, pages_per_task)]
+    if pool is None or len(ranges) <= 1:
+        parts = [extract_page_range(path, start, stop) for start, stop in ranges]
+    else:
+        futures = [pool.submit(extract_page_range, path, start, stop) for start, stop in ranges]
+        parts = [future.result() for future in futures]
+    return "".join(parts).strip()
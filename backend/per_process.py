@@ -0,0 +1,32 @@
+"""Lazily created per-process resources (threads, event loops, pools, connections).
+
+None of these survive a fork: a gunicorn worker forked from a preloaded master
+inherits the Python objects but not the threads behind them, and a connection
+or pool pipe shared with the master or a sibling worker gets corrupted. Objects
+that own such a resource create it through a PerProcess, which calls its factory
+the first time it is needed in each process and hands out that process's value.
+"""
+import os
+import threading
+
+
+class PerProcess:
+    def __init__(self, factory):
+        self.factory = factory
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns this process's value, calling the factory first if it has none yet."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._value = self.factory()
+                    self._pid = os.getpid()
+        return self._value
+
+    @property
+    def created(self):
+        """Whether get() has already created the value in this process."""
+        return self._pid == os.getpid()
@@ -0,0 +1,125 @@
+"""Two-tier TTL cache for results of external search APIs (Custom Search, YouTube).
+
+Tier one is an in-process LRU; tier two is an optional SQLite file shared by all
+workers on the host and surviving restarts. Keys are normalised queries, so
+"List in Python diagram" and "list  in python diagram" share an entry. Empty
+results are cached too (negative caching), with their own, usually shorter, TTL.
+"""
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from per_process import PerProcess
+
+log = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def normalize_query(query):
+    """Lower-cases the query and collapses whitespace."""
+    return re.sub(r"\s+", " ", str(query or "")).strip().lower()
+
+
+class ResultCache:
+    """LRU + optional SQLite cache with per-entry expiry and hit/miss counters."""
+
+    def __init__(self, namespace, max_entries=1024, ttl=86400, negative_ttl=600, sqlite_path=None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.sqlite_path = sqlite_path
+        self._conn = PerProcess(self._connect)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.sqlite_path, timeout=5, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS search_cache ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        conn.commit()
+        return conn
+
+    @property
+    def _db(self):
+        """The SQLite connection for this process, or None without a sqlite_path."""
+        return self._conn.get() if self.sqlite_path else None
+
+    def get(self, query, default=None):
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+            value = self._disk_get(key, now)
+            if value is not _MISSING:
+                self.disk_hits += 1
+                return value
+            self.misses += 1
+            return default
+
+    def set(self, query, value):
+        key = normalize_query(query)
+        expires_at = time.time() + (self.ttl if value else self.negative_ttl)
+        with self._lock:
+            self._remember(key, expires_at, value)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO search_cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                        (self.namespace, key, json.dumps(value), expires_at)
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    log.error("Error writing %s cache entry: %s", self.namespace, e)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def _remember(self, key, expires_at, value):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_get(self, key, now):
+        if self._db is None:
+            return _MISSING
+        try:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM search_cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+        except sqlite3.Error as e:
+            log.error("Error reading %s cache entry: %s", self.namespace, e)
+            return _MISSING
+        if row is None or row[1] <= now:
+            return _MISSING
+        value = json.loads(row[0])
+        self._remember(key, row[1], value)
+        return value
@@ -0,0 +1,99 @@
+"""Chunked BM25 retrieval over a session's uploaded study material.
+
+The extracted PDF text is split into overlapping word windows and indexed in an
+in-memory inverted index, so /chat can ground an answer in the few most relevant
+chunks instead of the whole document. Indexes are cached per session.
+"""
+import heapq
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it its me of on or "
+    "so that the this to was what when where which who why will with you your".split()
+)
+
+
+def tokenize(text):
+    return [token for token in re.findall(r"[a-z0-9_]+", (text or "").lower()) if token not in STOPWORDS]
+
+
+def chunk_text(text, chunk_words=200, overlap=40):
+    """Splits text into windows of chunk_words words, each overlapping the previous by overlap."""
+    words = (text or "").split()
+    step = max(1, chunk_words - overlap)
+    return [" ".join(words[start:start + chunk_words]) for start in range(0, max(len(words) - overlap, 1), step)
+            if words[start:start + chunk_words]]
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of chunks."""
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)  # term -> [(chunk index, term frequency)]
+        self.lengths = []
+        for index, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk))
+            self.lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                self.postings[term].append((index, frequency))
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        total = len(chunks)
+        self.idf = {
+            term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query, k=3):
+        """Returns up to k (chunk, score) pairs for the query, best first."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for index, frequency in self.postings[term]:
+                norm = frequency + self.k1 * (1 - self.b + self.b * self.lengths[index] / self.average_length)
+                scores[index] += idf * frequency * (self.k1 + 1) / norm
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.chunks[index], score) for index, score in best]
+
+
+def build_index(text, chunk_words=200, overlap=40):
+    """Returns a BM25Index over the text, or None if there is no text."""
+    chunks = chunk_text(text, chunk_words, overlap)
+    return BM25Index(chunks) if chunks else None
+
+
+class SessionIndexCache:
+    """LRU of per-session indexes. Sessions without material are remembered for
+    `empty_ttl` seconds so a background ingest finishing elsewhere is picked up."""
+
+    def __init__(self, max_sessions=256, empty_ttl=60):
+        self.max_sessions = max_sessions
+        self.empty_ttl = empty_ttl
+        self._indexes = OrderedDict()  # key -> (index or None, cached_at)
+        self._lock = threading.Lock()
+
+    def get(self, key, load_text):
+        """Returns the session's index, building it from load_text() on a miss."""
+        with self._lock:
+            entry = self._indexes.get(key)
+            if entry is not None and (entry[0] is not None or time.monotonic() - entry[1] < self.empty_ttl):
+                self._indexes.move_to_end(key)
+                return entry[0]
+        index = build_index(load_text())
+        self.put(key, index)
+        return index
+
+    def put(self, key, index):
+        with self._lock:
+            self._indexes[key] = (index, time.monotonic())
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_sessions:
+                self._indexes.popitem(last=False)
@@ -0,0 +1,283 @@
+"""Speech-to-text for audio recorded on the client.
+
+Audio arrives as 16-bit PCM, either as a whole WAV clip or streamed in chunks.
+A simple energy-based voice-activity detector cuts it into utterances; each
+utterance is sent to a recogniser as soon as it ends, so partial transcripts
+are available while the rest of the audio is still arriving. Recognisers are
+pluggable: `google` uses the Web Speech API through speech_recognition, and
+`sphinx` runs offline with PocketSphinx. Both are imported on first use.
+"""
+import io
+import socket
+import math
+import time
+import wave
+from array import array
+from concurrent.futures import wait, FIRST_COMPLETED
+
+SAMPLE_WIDTH = 2  # bytes per sample: 16-bit PCM only
+
+
+class RecognizerError(Exception):
+    """The recogniser backend failed (as opposed to hearing nothing)."""
+
+
+# --- Recognisers ---
+class Recognizer:
+    name = None
+
+    def transcribe(self, pcm, sample_rate, timeout=None):
+        """Returns the text for one utterance of mono 16-bit PCM, or '' if nothing was understood.
+        Must give up after `timeout` seconds: a running call can't be cancelled from outside."""
+        raise NotImplementedError
+
+
+class SpeechRecognitionBackend(Recognizer):
+    """Shared plumbing for the speech_recognition package's recognisers."""
+
+    def transcribe(self, pcm, sample_rate, timeout=None):
+        import speech_recognition as sr
+        audio = sr.AudioData(pcm, sample_rate, SAMPLE_WIDTH)
+        recognizer = sr.Recognizer()
+        recognizer.operation_timeout = timeout  # bounds the request to online recognisers
+        try:
+            return self.recognize(recognizer, audio)
+        except sr.UnknownValueError:
+            return ""
+        except sr.RequestError as e:
+            raise RecognizerError(str(e)) from e
+        except (TimeoutError, socket.timeout) as e:
+            raise RecognizerError("recognition timed out") from e
+
+    def recognize(self, recognizer, audio):
+        raise NotImplementedError
+
+
+class GoogleRecognizer(SpeechRecognitionBackend):
+    name = "google"
+
+    def __init__(self, language="en-US"):
+        self.language = language
+
+    def recognize(self, recognizer, audio):
+        return recognizer.recognize_google(audio, language=self.language)
+
+
+class SphinxRecognizer(SpeechRecognitionBackend):
+    """Offline recognition with PocketSphinx; needs no network or API key."""
+    name = "sphinx"
+
+    def __init__(self, language="en-US"):
+        self.language = language
+
+    def recognize(self, recognizer, audio):
+        return recognizer.recognize_sphinx(audio, language=self.language)
+
+
+RECOGNIZERS = {
+    GoogleRecognizer.name: GoogleRecognizer,
+    SphinxRecognizer.name: SphinxRecognizer,
+}
+
+
+def register_recognizer(name, factory):
+    """Makes a recogniser available to get_recognizer() under name."""
+    RECOGNIZERS[name] = factory
+
+
+def get_recognizer(name, **options):
+    try:
+        return RECOGNIZERS[name](**options)
+    except KeyError:
+        raise ValueError(f"Unknown speech recogniser '{name}' (available: {', '.join(sorted(RECOGNIZERS))})")
+
+
+# --- Audio input ---
+def read_wav(data):
+    """Decodes a WAV clip to (mono 16-bit PCM bytes, sample rate); raises ValueError otherwise."""
+    try:
+        with wave.open(io.BytesIO(data), 'rb') as clip:
+            channels, width, rate = clip.getnchannels(), clip.getsampwidth(), clip.getframerate()
+            frames = clip.readframes(clip.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise ValueError(f"Not a valid WAV file: {e}")
+    if width != SAMPLE_WIDTH:
+        raise ValueError("Only 16-bit PCM WAV is supported")
+    if channels > 1:
+        frames = array('h', frames)[::channels].tobytes()  # keep the first channel
+    return frames, rate
+
+
+def rms(pcm):
+    samples = array('h', pcm)
+    if not samples:
+        return 0.0
+    return math.sqrt(sum(s * s for s in samples) / len(samples))
+
+
+# --- Voice activity detection ---
+class VoiceActivitySegmenter:
+    """Splits a PCM stream into utterances by frame energy.
+
+    Speech starts once `start_frames` consecutive frames are louder than the noise
+    floor (tracked from quiet frames) by `ratio`, and ends after `end_silence_ms`
+    of quiet or at `max_segment_ms`. A little audio before the onset is kept so
+    the first syllable isn't clipped.
+    """
+
+    def __init__(self, sample_rate, frame_ms=30, ratio=3.0, min_rms=300, start_frames=3,
+                 end_silence_ms=600, max_segment_ms=15000, pre_roll_ms=300):
+        self.sample_rate = sample_rate
+        self.frame_bytes = int(sample_rate * frame_ms / 1000) * SAMPLE_WIDTH
+        self.frame_ms = frame_ms
+        self.ratio = ratio
+        self.min_rms = min_rms
+        self.start_frames = start_frames
+        self.end_silence_frames = max(1, end_silence_ms // frame_ms)
+        self.max_segment_frames = max(1, max_segment_ms // frame_ms)
+        self.pre_roll_frames = pre_roll_ms // frame_ms
+        self.noise_floor = None
+        self._pending = b""
+        self._frames = []  # frames of the current utterance, or the pre-roll while quiet
+        self._in_speech = False
+        self._loud_run = 0
+        self._quiet_run = 0
+        self._position = 0  # frames seen so far
+        self._start = 0
+
+    def _is_speech(self, frame):
+        energy = rms(frame)
+        floor = self.noise_floor if self.noise_floor is not None else energy
+        speech = energy > max(self.min_rms, floor * self.ratio)
+        if not speech:
+            self.noise_floor = energy if self.noise_floor is None else 0.95 * self.noise_floor + 0.05 * energy
+        return speech
+
+    def feed(self, pcm):
+        """Adds audio and returns the utterances it completed as (start_ms, end_ms, pcm) tuples."""
+        self._pending += pcm
+        segments = []
+        while len(self._pending) >= self.frame_bytes:
+            frame, self._pending = self._pending[:self.frame_bytes], self._pending[self.frame_bytes:]
+            segment = self._push(frame)
+            if segment:
+                segments.append(segment)
+        return segments
+
+    def _push(self, frame):
+        speech = self._is_speech(frame)
+        self._position += 1
+        self._frames.append(frame)
+        if not self._in_speech:
+            self._loud_run = self._loud_run + 1 if speech else 0
+            if self._loud_run >= self.start_frames:
+                self._in_speech = True
+                self._quiet_run = 0
+                self._start = self._position - len(self._frames)
+            else:
+                del self._frames[:-(self.pre_roll_frames + self.start_frames)]
+            return None
+
+        self._quiet_run = 0 if speech else self._quiet_run + 1
+        if self._quiet_run >= self.end_silence_frames or len(self._frames) >= self.max_segment_frames:
+            return self._close()
+        return None
+
+    def _close(self):
+        segment = (self._start * self.frame_ms, self._position * self.frame_ms, b"".join(self._frames))
+        self._frames = []
+        self._in_speech = False
+        self._loud_run = 0
+        return segment
+
+    def flush(self):
+        """Ends the stream; returns the utterance still in progress, if any."""
+        return self._close() if self._in_speech else None
+
+
+# --- Transcription ---
+class Transcriber:
+    """Runs VAD over incoming audio and recognises each utterance on `executor`.
+
+    `transcribe()` yields `partial` events in utterance order as results come back
+    and ends with one `final` event. The whole request is cut off after
+    `deadline_seconds` and audio beyond `max_audio_seconds` is ignored; both are
+    reported on the final event.
+    """
+
+    def __init__(self, recognizer, executor, deadline_seconds=30, max_audio_seconds=120, **vad_options):
+        self.recognizer = recognizer
+        self.executor = executor
+        self.deadline_seconds = deadline_seconds
+        self.max_audio_seconds = max_audio_seconds
+        self.vad_options = vad_options
+
+    def transcribe(self, chunks, sample_rate):
+        deadline = time.monotonic() + self.deadline_seconds
+        max_bytes = int(self.max_audio_seconds * sample_rate) * SAMPLE_WIDTH
+        segmenter = VoiceActivitySegmenter(sample_rate, **self.vad_options)
+        pending = []  # (index, start_ms, end_ms, future) in utterance order
+        texts = []
+        received = 0
+        truncated = timed_out = False
+
+        def submit(segments):
+            for start_ms, end_ms, pcm in segments:
+                # Whatever is left of the request's deadline (at least a second), so a hung call
+                # can't keep an executor thread after the request has given up on it
+                timeout = max(1.0, deadline - time.monotonic())
+                future = self.executor.submit(self.recognizer.transcribe, pcm, sample_rate, timeout)
+                pending.append((len(texts) + len(pending), start_ms, end_ms, future))
+
+        def ready():
+            # Results are released in order, so a slow utterance holds back later ones
+            while pending and pending[0][3].done():
+                index, start_ms, end_ms, future = pending.pop(0)
+                yield self._partial(index, start_ms, end_ms, future, texts)
+
+        for chunk in chunks:
+            if time.monotonic() >= deadline:
+                timed_out = True
+                break
+            if received + len(chunk) > max_bytes:
+                chunk = chunk[:max_bytes - received]
+                truncated = True
+            received += len(chunk)
+            submit(segmenter.feed(chunk))
+            yield from ready()
+            if truncated:
+                break
+
+        if not timed_out:
+            last = segmenter.flush()
+            if last:
+                submit([last])
+        while pending and not timed_out:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not wait([pending[0][3]], timeout=remaining, return_when=FIRST_COMPLETED).done:
+                timed_out = True
+                break
+            yield from ready()
+        for *_, future in pending:
+            future.cancel()
+
+        yield {
+            'type': 'final',
+            'text': " ".join(text for text in texts if text),
+            'segments': len(texts),
+            'audio_ms': received // SAMPLE_WIDTH * 1000 // sample_rate,
+            'timed_out': timed_out,
+            'truncated': truncated,
+        }
+
+    def _partial(self, index, start_ms, end_ms, future, texts):
+        try:
+            text = future.result().strip()
+            error = None
+        except Exception as e:
+            text, error = "", str(e)
+        texts.append(text)
+        event = {'type': 'partial', 'segment': index, 'start_ms': start_ms, 'end_ms': end_ms, 'text': text}
+        if error:
+            event['error'] = error
+        return event
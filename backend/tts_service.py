@@ -0,0 +1,130 @@
+"""Text-to-speech rendered to in-memory WAV audio for the client to play.
+
+pyttsx3 engines aren't thread-safe and `pyttsx3.init()` hands every caller the same
+engine, so one worker thread per process owns it and renders queued requests to
+audio files that are read back into memory. Rendered audio is kept in an LRU keyed
+on (text, voice, rate), since the tutor repeats many phrases, and concurrent
+requests for the same audio wait on a single render.
+"""
+import logging
+import os
+import queue
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from per_process import PerProcess
+
+log = logging.getLogger(__name__)
+
+
+class TTSService:
+    def __init__(self, rate=150, volume=1.0, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.rate = rate
+        self.volume = volume
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._audio = OrderedDict()  # (text, voice, rate) -> WAV bytes
+        self._audio_bytes = 0
+        self._in_flight = {}  # key -> Future shared by every waiter
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = PerProcess(self._start_worker)
+        self.hits = 0
+        self.misses = 0
+
+    def _start_worker(self):
+        with self._lock:
+            self._queue = queue.Queue()
+            self._in_flight = {}
+        worker = threading.Thread(target=self._run, name="tts-engine", daemon=True)
+        worker.start()
+        return worker
+
+    def synthesize(self, text, voice=None, rate=None, timeout=None):
+        """Returns WAV bytes for text; raises concurrent.futures.TimeoutError after timeout."""
+        key = (text, voice, rate or self.rate)
+        self._worker.get()
+        with self._lock:
+            if key in self._audio:
+                self._audio.move_to_end(key)
+                self.hits += 1
+                return self._audio[key]
+            self.misses += 1
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._in_flight[key] = Future()
+                self._queue.put((key, future))
+        return future.result(timeout)
+
+    def voices(self, timeout=None):
+        """Lists the voices the engine offers as (id, name) pairs."""
+        self._worker.get()
+        future = Future()
+        self._queue.put((None, future))
+        return future.result(timeout)
+
+    def _run(self):
+        try:
+            import pyttsx3
+            engine = pyttsx3.init()
+            engine.setProperty('volume', self.volume)
+            default_voice = engine.getProperty('voice')
+        except Exception as e:
+            log.error("Error starting TTS engine: %s", e)
+            engine, startup_error = None, e
+
+        while True:
+            key, future = self._queue.get()
+            if engine is None:
+                self._finish(key, future, error=startup_error)
+                continue
+            try:
+                if key is None:
+                    result = [(v.id, v.name) for v in engine.getProperty('voices')]
+                else:
+                    result = self._render(engine, *key, default_voice=default_voice)
+            except Exception as e:
+                self._finish(key, future, error=e)
+            else:
+                self._finish(key, future, result=result)
+
+    def _render(self, engine, text, voice, rate, default_voice):
+        fd, path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            engine.setProperty('voice', voice or default_voice)
+            engine.setProperty('rate', rate)
+            engine.save_to_file(text, path)
+            engine.runAndWait()
+            with open(path, 'rb') as f:
+                return f.read()
+        finally:
+            os.remove(path)
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            if key is not None:
+                self._in_flight.pop(key, None)
+                if error is None and len(result) <= self.max_bytes:
+                    self._audio[key] = result
+                    self._audio_bytes += len(result)
+                    while len(self._audio) > self.max_entries or self._audio_bytes > self.max_bytes:
+                        _, evicted = self._audio.popitem(last=False)
+                        self._audio_bytes -= len(evicted)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._audio),
+                'bytes': self._audio_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,40 @@
+"""Per-user cache of the profile fields /chat needs and the rendered tutor prompt.
+
+Entries are evicted least-recently-used and expire after `ttl` seconds, which
+bounds how stale another worker's copy can get; the worker handling /save-score
+invalidates its own entry immediately.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+UserProfile = namedtuple("UserProfile", ["user_id", "iq_score", "system_instruction"])
+
+
+class UserProfileCache:
+    def __init__(self, max_users=4096, ttl=300):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._profiles = OrderedDict()  # user_id -> (UserProfile, cached_at)
+        self._lock = threading.Lock()
+
+    def get(self, user_id, load):
+        """Returns the cached profile, or calls load() (which may return None for unknown users)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._profiles.get(user_id)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._profiles.move_to_end(user_id)
+                return entry[0]
+        profile = load()
+        if profile is not None:
+            with self._lock:
+                self._profiles[user_id] = (profile, now)
+                self._profiles.move_to_end(user_id)
+                while len(self._profiles) > self.max_users:
+                    self._profiles.popitem(last=False)
+        return profile
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._profiles.pop(user_id, None)
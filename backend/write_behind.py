@@ -0,0 +1,176 @@
+"""Write-behind batching for rows written on the request path.
+
+Requests queue rows instead of committing them one transaction at a time. A
+writer thread inserts whatever has queued up in one bulk insert and one commit
+once `max_batch` rows are waiting or the oldest has waited `max_wait_ms`. Readers
+that must see their own writes call `flush(match)`: it commits the matching
+queued rows right away and waits for them. `close()` drains the queue on shutdown.
+
+Row ids have to be known before the insert, so they come from an IdAllocator
+that reserves them from the database in blocks.
+"""
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import Future, wait
+
+from per_process import PerProcess
+
+log = logging.getLogger(__name__)
+
+
+class IdAllocator:
+    """Hands out ids from blocks reserved with `reserve(count) -> iterable of ids`."""
+
+    def __init__(self, reserve, block_size=1):
+        self.reserve = reserve
+        self.block_size = block_size
+        # Ids reserved before a fork would be handed out by every worker
+        self._ids = PerProcess(collections.deque)
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            ids = self._ids.get()
+            if not ids:
+                ids.extend(self.reserve(self.block_size))
+            return ids.popleft()
+
+
+class WriteBehindQueue:
+    """Collects rows and writes them in batches with `write_batch(rows)`.
+
+    `write_batch` must insert and commit all rows or raise. A failed batch is
+    retried, then written row by row so that one bad row doesn't take the
+    others with it. Rows that still fail are logged and their futures fail.
+    """
+
+    def __init__(self, write_batch, max_batch=200, max_wait_ms=50, retries=3, name="write-behind"):
+        self.write_batch = write_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.retries = retries
+        self.name = name
+        self._pending = []  # (row, future, queued_at)
+        self._writing = []  # the batch being written
+        self._flush_requested = False
+        self._closing = False
+        self._cond = threading.Condition()
+        self._worker = PerProcess(self._start_worker)
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+
+    def _start_worker(self):
+        # A condition inherited across a fork may still list the parent's waiting threads
+        self._cond = threading.Condition()
+        self._pending, self._writing = [], []
+        self._closing = False
+        worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+        worker.start()
+        return worker
+
+    def add(self, row):
+        """Queues a row; the returned Future completes once it is committed."""
+        self._worker.get()
+        future = Future()
+        with self._cond:
+            if self._closing:
+                raise RuntimeError(f"{self.name} is shut down")
+            self._pending.append((row, future, time.monotonic()))
+            if len(self._pending) >= self.max_batch or len(self._pending) == 1:
+                self._cond.notify()
+        return future
+
+    def flush(self, match=None, timeout=None):
+        """Commits the queued rows for which match(row) is true (all rows without a match)
+        right away and waits for them. Write errors are left to the writer to report."""
+        with self._cond:
+            futures = [future for row, future, _ in self._pending + self._writing if match is None or match(row)]
+            if not futures:
+                return True
+            if self._pending:
+                self._flush_requested = True
+                self._cond.notify()
+        done, not_done = wait(futures, timeout)
+        return not not_done
+
+    def close(self, timeout=30):
+        """Stops accepting rows and writes out everything still queued."""
+        if not self._worker.created:
+            return
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        worker = self._worker.get()
+        worker.join(timeout)
+        if worker.is_alive():
+            log.error("%s: %d rows not written before shutdown", self.name, len(self._pending))
+
+    def _take_batch(self):
+        with self._cond:
+            while True:
+                if self._pending:
+                    if self._closing or self._flush_requested or len(self._pending) >= self.max_batch:
+                        break
+                    remaining = self._pending[0][2] + self.max_wait - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                elif self._closing:
+                    return None
+                else:
+                    self._cond.wait()
+            batch = self._writing = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            if not self._pending:
+                self._flush_requested = False
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            self._write(batch)
+            with self._cond:
+                self._writing = []
+
+    def _write(self, batch):
+        rows = [row for row, _, _ in batch]
+        for attempt in range(self.retries):
+            try:
+                self.write_batch(rows)
+                break
+            except Exception as e:
+                log.warning("%s: batch of %d rows failed (%s), retrying", self.name, len(rows), e)
+                time.sleep(0.1 * 2 ** attempt)
+        else:
+            self._write_one_by_one(batch)
+            return
+        self.written += len(rows)
+        self.batches += 1
+        for _, future, _ in batch:
+            future.set_result(None)
+
+    def _write_one_by_one(self, batch):
+        for row, future, _ in batch:
+            try:
+                self.write_batch([row])
+            except Exception as e:
+                self.failed += 1
+                log.error("%s: could not write row %r: %s", self.name, row, e)
+                future.set_exception(e)
+            else:
+                self.written += 1
+                future.set_result(None)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._pending) + len(self._writing),
+                'written': self.written,
+                'batches': self.batches,
+                'failed': self.failed,
+            }
@@ -0,0 +1,4 @@
+"""Production entry point: `gunicorn -c gunicorn.conf.py wsgi:app` (run from backend/)."""
+from newback import create_app
+
+app = create_app()
@@ -78,6 +78,8 @@ const Archimedes = () => {
     const [videoDoubtResponse, setVideoDoubtResponse] = useState("");
     
     const [isMinimized, setIsMinimized] = useState(false);
+    const [historyCursor, setHistoryCursor] = useState(null); // Cursor for the next page of older messages
+    const HISTORY_PAGE_SIZE = 50;
     const videoModalRef = useRef(null);
     const offset = useRef({ x: 0, y: 0 });
     const isDragging = useRef(false);
@@ -165,7 +167,7 @@ const Archimedes = () => {
     useEffect(() => {
         const fetchChatHistory = async () => {
             try {
-                    const response = await fetch(`${backendUrl}/history/${user_id}?sessionName=${encodeURIComponent(sessionName)}`);                if (!response.ok) {
+                    const response = await fetch(`${backendUrl}/history/${user_id}?sessionName=${encodeURIComponent(sessionName)}&limit=${HISTORY_PAGE_SIZE}`);                if (!response.ok) {
                     console.error(`Failed to fetch chat history: ${response.status}`);
                     setChatHistory([
                         {
@@ -176,7 +178,9 @@ const Archimedes = () => {
                     ]);
                     return;
                 }
-                const data = await response.json();
+                const page = await response.json();
+                const data = page.messages;
+                setHistoryCursor(page.next_cursor);
                 // Ensure the initial bot message is always present if history is empty
                 if (data.length === 0) {
                      setChatHistory([
@@ -212,6 +216,25 @@ const Archimedes = () => {
         }
     }, [backendUrl, user_id, sessionName]); // Dependencies: re-run if backendUrl or user_id changes
 
+    // Function to load the page of messages before the oldest one shown
+    const loadEarlierMessages = async () => {
+        if (!historyCursor) return;
+        try {
+            const response = await fetch(`${backendUrl}/history/${user_id}?sessionName=${encodeURIComponent(sessionName)}&limit=${HISTORY_PAGE_SIZE}&before=${encodeURIComponent(historyCursor)}`);
+            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+            const page = await response.json();
+            const olderMessages = page.messages.map((item) => ({
+                role: item.role,
+                text: item.text,
+                images: item.images || []
+            }));
+            setChatHistory((prev) => [...olderMessages, ...prev]);
+            setHistoryCursor(page.next_cursor);
+        } catch (error) {
+            console.error("Error loading earlier messages:", error);
+        }
+    };
+
     // Effect to handle clicks outside the persona tab to close it
     useEffect(() => {
         const handleClickOutside = (event) => {
@@ -308,6 +331,29 @@ const Archimedes = () => {
         }
     };
 
+    // Function to fetch images that the backend finds after a reply has been sent
+    const fetchPendingImages = async (chatId) => {
+        for (let attempt = 0; attempt < 5; attempt++) {
+            if (attempt > 0) {
+                // Back off between long polls: 1s, 2s, 4s, ...
+                await new Promise((resolve) => setTimeout(resolve, 1000 * 2 ** (attempt - 1)));
+            }
+            try {
+                const response = await fetch(`${backendUrl}/chat/${chatId}/images?wait=5`);
+                if (response.status === 202) continue; // Still being fetched
+                if (!response.ok) return;
+                const data = await response.json();
+                const images = data.images || [];
+                setChatHistory((prev) => prev.map((msg) => (msg.chatId === chatId ? { ...msg, images } : msg)));
+                setImageResults(images);
+                return;
+            } catch (error) {
+                console.error("Error fetching images:", error);
+                return;
+            }
+        }
+    };
+
     // Function to send user messages to the backend and get bot responses
     const generateBotResponse = async (history, message) => {
     console.log("User message sent:", message);
@@ -348,10 +394,15 @@ const Archimedes = () => {
         // Update chat history with the bot's response and images, removing any bold markdown
         setChatHistory((prev) => [
             ...prev.filter((msg) => msg.text !== "Thinking..."), // Remove "Thinking..." message
-            { role: "model", text: apiResponseText.replace(/\*\*(.*?)\*\*/g, "$1").trim(), images: fetchedImages }, // Add the new bot message and images
+            { role: "model", text: apiResponseText.replace(/\*\*(.*?)\*\*/g, "$1").trim(), images: fetchedImages, chatId: data.chat_id }, // Add the new bot message and images
         ]);
         setImageResults(fetchedImages); // Update image results state
 
+        // Images are found in the background after the reply is sent; pick them up when ready
+        if (data.images_pending && data.chat_id) {
+            fetchPendingImages(data.chat_id);
+        }
+
     } catch (error) {
         console.error("Error communicating with backend:", error);
         // Update chat history with an error message
@@ -469,6 +520,11 @@ const Archimedes = () => {
                 </div>
 
                 <div className="chat-body">
+                    {historyCursor && (
+                        <button className="load-earlier-button" onClick={loadEarlierMessages}>
+                            Load earlier messages
+                        </button>
+                    )}
                     {/* Initial welcome message for the user */}
                     <div className="message bot-message">
                         <ChatbotIcon/>
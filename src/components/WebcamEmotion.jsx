@@ -32,6 +32,10 @@ function WebcamEmotion() {
   const lastFrameTimeRef = useRef(0);
   const FRAME_INTERVAL = 500; // 500ms = 2 frames per second
   
+  // The server tracks a smoothed emotion per client and tells us to back off while it is steady
+  const clientIdRef = useRef(crypto.randomUUID());
+  const skipUntilRef = useRef(0);
+  
   // Debug counter for tracking processed frames
   const frameCountRef = useRef(0);
   
@@ -75,6 +79,7 @@ function WebcamEmotion() {
       // Real API call to DeepFace server
       const formData = new FormData();
       formData.append("image", faceImageBlob, "face.jpg");
+      formData.append("client_id", clientIdRef.current);
 
       const response = await fetch(DEEPFACE_API_URL, {
         method: "POST",
@@ -87,6 +92,7 @@ function WebcamEmotion() {
       
       const result = await response.json();
       console.log("Emotion result:", result);
+      skipUntilRef.current = Date.now() + (result.skip_next_ms || 0);
       console.log("Current recentEmotions:", recentEmotionsRef.current);
       
       // Check if the result contains an emotion
@@ -390,7 +396,7 @@ function WebcamEmotion() {
       onFrame: async () => {
         // Throttle frame processing to 2 frames per second
         const currentTime = Date.now();
-        if (currentTime - lastFrameTimeRef.current >= FRAME_INTERVAL) {
+        if (currentTime - lastFrameTimeRef.current >= FRAME_INTERVAL && currentTime >= skipUntilRef.current) {
           lastFrameTimeRef.current = currentTime;
           console.log("Sending frame to FaceMesh for processing");
           await faceMeshRef.current.send({ image: videoRef.current });